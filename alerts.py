@@ -0,0 +1,89 @@
+"""
+Critical-value alerts that bypass the LLM queue.
+
+preproc.preprocess_bloodwork_data checks every normalized row against
+CRITICAL_LIMITS as it goes. The preproc lambda publishes the result to
+alerts/<file>.json in the summaries bucket straight away, before the trigger
+and summary chain even starts, and the app shows it as soon as it lands.
+Limits are in the canonical units from preproc.target_units. preproc only
+relabels a unit after converting the value by a known rule; a unit it has
+no rule for is kept as uploaded. So a row in any other unit is never
+flagged, because the comparison would be meaningless.
+
+Configured from the environment:
+    CRITICAL_LIMITS_FILE  JSON file of {test: {"unit", "low", "high"}} that
+                          replaces the defaults below
+    ALERTS_BUCKET         where the lambda writes alerts, default the summaries bucket
+"""
+import json
+import os
+import time
+
+import metrics
+import storage
+
+ALERT_PREFIX = 'alerts/'
+ALERTS_BUCKET = os.environ.get('ALERTS_BUCKET', 'processed-bloodtest-upload-sk')
+
+# Common adult critical (panic) limits; a missing bound is never critical
+DEFAULT_CRITICAL_LIMITS = {
+    'Glucose': {'unit': 'mg/dL', 'low': 40.0, 'high': 500.0},
+    'Sodium': {'unit': 'mmol/L', 'low': 120.0, 'high': 160.0},
+    'Potassium': {'unit': 'mmol/L', 'low': 2.5, 'high': 6.5},
+    'Calcium': {'unit': 'mg/dL', 'low': 6.0, 'high': 13.0},
+    'Hemoglobin': {'unit': 'g/dL', 'low': 7.0, 'high': 20.0},
+    'Hematocrit': {'unit': '%', 'low': 20.0, 'high': 60.0},
+    'Platelets': {'unit': '10^3/uL', 'low': 20.0, 'high': 1000.0},
+    'WBC': {'unit': '10^3/uL', 'low': 2.0, 'high': 30.0},
+}
+
+
+def load_limits():
+    path = os.environ.get('CRITICAL_LIMITS_FILE')
+    if not path:
+        return DEFAULT_CRITICAL_LIMITS
+    with open(path) as f:
+        return json.load(f)
+
+
+CRITICAL_LIMITS = load_limits()
+
+
+def check_row(row, limits=None):
+    """Returns an alert dict if the row's value is past a critical limit, else None"""
+    limit = (limits or CRITICAL_LIMITS).get(row.get('test_name'))
+    value = row.get('value')
+    if limit is None or value is None or (row.get('unit') or '').strip() != limit['unit']:
+        return None
+    low, high = limit.get('low'), limit.get('high')
+    if low is not None and value < low:
+        direction, bound = 'low', low
+    elif high is not None and value > high:
+        direction, bound = 'high', high
+    else:
+        return None
+    return {
+        'test_name': row['test_name'],
+        'value': value,
+        'unit': limit['unit'],
+        'direction': direction,
+        'limit': bound,
+        'date': row.get('date'),
+    }
+
+
+def alert_key(filename):
+    return f"{ALERT_PREFIX}{os.path.basename(filename)}.json"
+
+
+def publish(s3, filename, hits, correlation_id=None, bucket=None):
+    """
+    Writes the check result for one file. Written even when nothing is
+    critical, so the app can tell "no alerts" apart from "not checked yet".
+    """
+    body = json.dumps({'filename': filename, 'checked_at': time.time(), 'alerts': hits})
+    metadata = {'alert-count': str(len(hits))}
+    if correlation_id:
+        metadata[metrics.CORRELATION_METADATA_KEY] = correlation_id
+    storage.put_object(s3, bucket or ALERTS_BUCKET, alert_key(filename), body, metadata,
+                       ContentType='application/json')
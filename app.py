@@ -1,35 +1,167 @@
 import streamlit as st
 import pandas as pd
 import time
-import boto3
-from botocore.exceptions import NoCredentialsError
 import io
+import json
+import hashlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 import psycopg2
 from psycopg2 import sql
 import plotly.express as px
 import plotly.graph_objects as go
 
+import alerts
+import ingest
+import lrucache
+import metrics
+import profiling
+import reports
+import resilience
+import scheduler
+import schema
+import storage
+import summaries
 
-# helper function for upload
-def upload_to_s3(file_buffer, filename, bucket, aws_access_key, aws_secret_key, region="us-east-1"):
+
+# Sample dataset for demo mode. Built once per process; callers must not mutate it.
+SAMPLE_DATA = pd.DataFrame({
+   'panel_category': [
+       'CBC', 'CBC', 'CBC',
+       'CMP', 'CMP', 'CMP',
+       'Lipid Panel', 'Lipid Panel', 'Lipid Panel', 'Lipid Panel',
+       'Vitamins', 'Hormones'
+   ],
+   'test_name': [
+       'Hemoglobin', 'White Blood Cells', 'Platelets',
+       'Glucose', 'ALT', 'Creatinine',
+       'Total Cholesterol', 'HDL Cholesterol', 'LDL Cholesterol', 'Triglycerides',
+       'Vitamin D', 'TSH'
+   ],
+   'date': ['2023-05-15'] * 12,
+   'value': [14.2, 6.8, 250.0,
+            92.0, 25.0, 0.9,
+            185.0, 55.0, 110.0, 120.0,
+            38.0, 2.5],
+   'unit': ['g/dL', 'k/μL', 'k/μL',
+           'mg/dL', 'U/L', 'mg/dL',
+           'mg/dL', 'mg/dL', 'mg/dL', 'mg/dL',
+           'ng/mL', 'mIU/L'],
+   'reference_range': [
+       '13.0-17.0', '4.5-11.0', '150.0-450.0',
+       '70.0-99.0', '7.0-55.0', '0.6-1.2',
+       '< 200.0', '> 40.0', '< 130.0', '< 150.0',
+       '30.0-100.0', '0.4-4.0'
+   ]
+})
+SAMPLE_CSV_BYTES = SAMPLE_DATA.to_csv(index=False).encode('utf-8')
+SAMPLE_FILENAME = "sample_data.csv"
+
+
+# Cloud I/O runs here so it never blocks a rerun
+_background = ThreadPoolExecutor(max_workers=4, thread_name_prefix="s3-background")
+
+_sample_upload_lock = threading.Lock()
+_sample_upload_future = None
+
+
+def upload_if_changed(body, filename, bucket, aws_access_key, aws_secret_key, region="us-east-1"):
+   """
+   Uploads body unless the object already holds identical bytes. Returns
+   'uploaded' or 'unchanged'. Safe to call from a background thread.
+   """
+   s3 = resilience.s3_client(
+       aws_access_key_id=aws_access_key,
+       aws_secret_access_key=aws_secret_key,
+       region_name=region
+   )
+   digest = hashlib.sha256(body).hexdigest()
    try:
-       s3 = boto3.client(
-           's3',
-           aws_access_key_id=aws_access_key,
-           aws_secret_access_key=aws_secret_key,
-           region_name=region
-       )
-       s3.upload_fileobj(file_buffer, bucket, filename)
-       return True
-   except NoCredentialsError:
-       return False
-   except Exception as e:
-       st.error(f"Failed to upload to S3: {e}")
-       return False
+       head = s3.head_object(Bucket=bucket, Key=filename)
+       if head.get('Metadata', {}).get('content-sha256') == digest:
+           return 'unchanged'
+   except Exception:
+       # Missing object (or no permission to HEAD); fall through to upload
+       pass
+   storage.put_object(s3, bucket, filename, body, {'content-sha256': digest})
+   return 'uploaded'
+
+
+def ensure_sample_uploaded():
+   """
+   Starts the sample upload at most once per process and returns its future.
+   A failed attempt is retried on the next call.
+   """
+   global _sample_upload_future
+   with _sample_upload_lock:
+       if _sample_upload_future is None or (
+               _sample_upload_future.done() and _sample_upload_future.exception() is not None):
+           _sample_upload_future = _background.submit(
+               upload_if_changed,
+               SAMPLE_CSV_BYTES,
+               SAMPLE_FILENAME,
+               st.secrets["S3_BUCKET_NORMAL"],
+               st.secrets["AWS_ACCESS_KEY"],
+               st.secrets["AWS_SECRET_KEY"]
+           )
+       return _sample_upload_future
+
+
+# Classify a single result against its reference range
+def classify_value(value, range_str):
+   """Return 'Normal', 'High', 'Low' or 'Unknown' for one value and its reference range string"""
+   # Results like "<0.5" or "pending" are read as NaN, which passes every comparison below
+   if pd.isna(value):
+       return 'Unknown'
+   try:
+       if '<' in range_str:
+           # Handle formats like "< 200.0"
+           threshold = float(range_str.replace('<', '').strip())
+           return 'High' if value > threshold else 'Normal'
+       elif '>' in range_str:
+           # Handle formats like "> 40.0"
+           threshold = float(range_str.replace('>', '').strip())
+           return 'Low' if value < threshold else 'Normal'
+       elif '-' in range_str:
+           # Handle ranges like "13.0-17.0"
+           lower, upper = map(float, range_str.split('-'))
+           if value < lower:
+               return 'Low'
+           elif value > upper:
+               return 'High'
+           return 'Normal'
+   except:
+       pass
+   return 'Unknown'
+
+
+STATUS_LABELS = {
+   'Normal': "✅ Normal",
+   'High': "⚠️ High",
+   'Low': "⚠️ Low",
+   'Unknown': "❓ Unknown"
+}
+
+RANGE_STATUS_LABELS = {
+   'Normal': 'Normal',
+   'High': 'Above Range',
+   'Low': 'Below Range',
+   'Unknown': 'Unknown'
+}
+
+
+def classify_results(df):
+   """Return a copy of df with a display status column for the results table"""
+   result_df = df.copy()
+   result_df['status'] = [STATUS_LABELS[classify_value(value, range_str)]
+                          for value, range_str in zip(df['value'], df['reference_range'])]
+   return result_df
 
 
 # Generate visualization of results
+@profiling.timed
 def generate_result_plot(df):
    # Keep original plot logic but enhance it
    fig, ax = plt.subplots(figsize=(10, 5))
@@ -93,6 +225,7 @@ def generate_result_plot(df):
 
 
 # Create additional visualizations
+@profiling.timed
 def create_panel_distribution(df):
    """Create a pie chart of test distribution by panel category"""
    if 'panel_category' in df.columns:
@@ -107,42 +240,15 @@ def create_panel_distribution(df):
    return None
 
 
+@profiling.timed
 def create_range_status_visualization(df):
    """Create a visualization showing which values are in/out of range"""
    if 'reference_range' not in df.columns:
        return None
       
    # Create a new status column
-   statuses = []
-   for i, row in df.iterrows():
-       try:
-           range_str = row['reference_range']
-           value = row['value']
-          
-           if '<' in range_str:
-               threshold = float(range_str.replace('<', '').strip())
-               if value > threshold:
-                   statuses.append('Above Range')
-               else:
-                   statuses.append('Normal')
-           elif '>' in range_str:
-               threshold = float(range_str.replace('>', '').strip())
-               if value < threshold:
-                   statuses.append('Below Range')
-               else:
-                   statuses.append('Normal')
-           elif '-' in range_str:
-               lower, upper = map(float, range_str.split('-'))
-               if value < lower:
-                   statuses.append('Below Range')
-               elif value > upper:
-                   statuses.append('Above Range')
-               else:
-                   statuses.append('Normal')
-           else:
-               statuses.append('Unknown')
-       except:
-           statuses.append('Unknown')
+   statuses = [RANGE_STATUS_LABELS[classify_value(value, range_str)]
+               for value, range_str in zip(df['value'], df['reference_range'])]
   
    status_df = pd.DataFrame({
        'Test': df['test_name'],
@@ -169,6 +275,7 @@ def create_range_status_visualization(df):
    return fig
 
 
+@profiling.timed
 def create_test_gauge_charts(df):
    """Create gauge charts for each test showing where the value falls in the reference range"""
    if 'reference_range' not in df.columns:
@@ -280,23 +387,6 @@ def create_test_gauge_charts(df):
    return figs
 
 
-# Function to display custom loading animation
-def display_loading_animation(text="Processing..."):
-   # Custom CSS for animated loading indicator
-   st.markdown("""
-   <div style="display: flex; flex-direction: column; align-items: center; justify-content: center; padding: 20px;">
-       <svg width="60" height="60" viewBox="0 0 50 50">
-           <path fill="#3498db" d="M25,5A20.14,20.14,0,0,1,45,22.88a2.51,2.51,0,0,0,2.49,2.26h0A2.52,2.52,0,0,0,50,22.33a25.14,25.14,0,0,0-50,0,2.52,2.52,0,0,0,2.5,2.81h0A2.51,2.51,0,0,0,5,22.88,20.14,20.14,0,0,1,25,5Z">
-               <animateTransform attributeName="transform" type="rotate" from="0 25 25" to="360 25 25" dur="0.6s" repeatCount="indefinite"/>
-           </path>
-       </svg>
-       <div style="color: #3498db; font-size: 18px; font-weight: bold; text-align: center; margin-top: 15px;">
-           {text}
-       </div>
-   </div>
-   """.format(text=text), unsafe_allow_html=True)
-
-
 # Keep original RDS/S3 functions
 def save_to_rds(summary_text, plot_bytes, filename):
    db_config = {
@@ -309,7 +399,7 @@ def save_to_rds(summary_text, plot_bytes, filename):
 
 
    try:
-       conn = psycopg2.connect(**db_config)
+       conn = resilience.connect_rds(**db_config)
        cursor = conn.cursor()
        insert_query = sql.SQL("""
            INSERT INTO blood_analysis (filename, summary, plot_image)
@@ -323,42 +413,327 @@ def save_to_rds(summary_text, plot_bytes, filename):
        st.error(f"Failed to save to RDS: {e}")
 
 
-def load_summary_from_s3(filename):
-   s3 = boto3.client(
-       's3',
+SUMMARY_PENDING = "⏳ Summary not available yet. (EC2 may still be processing)"
+
+# Backoff between summary checks while EC2 is working: 2s, 4s, 8s ... capped at 30s
+SUMMARY_POLL_INITIAL = 2.0
+SUMMARY_POLL_MAX_DELAY = 30.0
+SUMMARY_MAX_CHECKS = 25
+
+
+@st.cache_resource
+def get_summary_s3_client():
+   return resilience.s3_client(
        aws_access_key_id=st.secrets["AWS_ACCESS_KEY"],
        aws_secret_access_key=st.secrets["AWS_SECRET_KEY"],
        region_name=st.secrets.get("AWS_REGION", "us-east-1")
    )
+
+
+def load_summary_from_s3(filename, correlation_id=None):
+   """
+   Returns the summary text, or None while EC2 is still processing. Repeat
+   reads are revalidated by ETag instead of downloading the object again.
+   """
    key = f"summaries/{filename}-summary.txt"
-   try:
-       obj = s3.get_object(Bucket=st.secrets["S3_BUCKET_NORMAL"], Key=key)
-       return obj["Body"].read().decode("utf-8")
-   except Exception as e:
-       return f"⏳ Summary not available yet. (EC2 may still be processing)\n\nError: {e}"
-  
-def notify_ec2_to_process(filename):        
-   s3 = boto3.client(
-       's3',
+   with metrics.span('summary_read', correlation_id=correlation_id):
+       summary = summaries.fetch_summary(get_summary_s3_client(), st.secrets["S3_BUCKET_NORMAL"], key)
+   metrics.inc('summary_read_total', status='ready' if summary is not None else 'pending')
+   return summary
+
+
+def _summary_panel(filename, correlation_id=None):
+   """
+   Shows the AI summary card, re-checking S3 with exponential backoff until
+   the summary lands. Returns the text that was shown.
+   """
+   poll = st.session_state.setdefault(f"summary_poll:{filename}", {
+       'attempt': 0,
+       'next_check': 0.0,
+       'summary': None,
+       'error': None
+   })
+
+   if poll['summary'] is None and poll['attempt'] >= SUMMARY_MAX_CHECKS:
+       if st.button("Check again", key=f"summary_retry_{filename}"):
+           poll.update(attempt=0, next_check=0.0)
+
+   if poll['summary'] is None and poll['attempt'] < SUMMARY_MAX_CHECKS and time.time() >= poll['next_check']:
+       try:
+           poll['summary'] = load_summary_from_s3(filename, correlation_id)
+           poll['error'] = None
+       except Exception as e:
+           poll['error'] = e
+       poll['attempt'] += 1
+       delay = min(SUMMARY_POLL_INITIAL * 2 ** (poll['attempt'] - 1), SUMMARY_POLL_MAX_DELAY)
+       poll['next_check'] = time.time() + delay
+
+   summary = poll['summary']
+   if summary is None:
+       summary = SUMMARY_PENDING
+       if poll['error'] is not None:
+           summary += f"\n\nError: {poll['error']}"
+
+   st.markdown(f"""
+   <div style="background-color: white; padding: 20px; border-radius: 10px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);">
+       <h4 style="color: #3498db; margin-top: 0;">Healthcare AI Analysis</h4>
+       <div style="margin-top: 15px; white-space: pre-line; color: #2c3e50;">
+           {summary}
+       </div>
+   </div>
+   """, unsafe_allow_html=True)
+
+   if poll['summary'] is None and poll['attempt'] < SUMMARY_MAX_CHECKS:
+       st.caption(f"Checking again in {max(0, poll['next_check'] - time.time()):.0f}s...")
+   return summary
+
+
+# Refresh the summary card on its own until the summary arrives, where supported
+if hasattr(st, 'fragment'):
+   summary_panel = st.fragment(run_every=1)(_summary_panel)
+else:
+   summary_panel = _summary_panel
+
+
+# Critical-value alerts come straight from the preproc lambda, so poll them
+# quickly and without backoff
+ALERT_MAX_CHECKS = 60
+_alert_cache = lrucache.LRUCache(max_entries=64)
+
+
+def load_alerts_from_s3(filename, correlation_id=None):
+   """Critical-value alerts for the file, or None until the lambda has checked it"""
+   bucket = st.secrets.get("S3_BUCKET_ALERTS", st.secrets["S3_BUCKET_NORMAL"])
+   with metrics.span('alert_read', correlation_id=correlation_id):
+       text = summaries.fetch_summary(get_summary_s3_client(), bucket, alerts.alert_key(filename), _alert_cache)
+   return None if text is None else json.loads(text)['alerts']
+
+
+def _alerts_panel(filename, correlation_id=None):
+   """Shows critical values as soon as the lambda publishes them, ahead of the AI summary"""
+   poll = st.session_state.setdefault(f"alerts_poll:{filename}", {'attempt': 0, 'alerts': None})
+   if poll['alerts'] is None and poll['attempt'] < ALERT_MAX_CHECKS:
+       try:
+           poll['alerts'] = load_alerts_from_s3(filename, correlation_id)
+       except Exception:
+           # Transient S3 errors just count as another attempt
+           pass
+       poll['attempt'] += 1
+
+   hits = poll['alerts']
+   if hits:
+       for hit in hits:
+           st.error(f"🚨 Critical {hit['direction']} value: {hit['test_name']} {hit['value']} {hit['unit']} "
+                    f"(critical limit {hit['limit']}). Contact your healthcare provider promptly.")
+   elif hits is None and poll['attempt'] < ALERT_MAX_CHECKS:
+       st.caption("Checking for critical values...")
+   return hits
+
+
+if hasattr(st, 'fragment'):
+   alerts_panel = st.fragment(run_every=1)(_alerts_panel)
+else:
+   alerts_panel = _alerts_panel
+
+
+def notify_ec2_to_process(filename, correlation_id=None, severity=0.0):
+   s3 = resilience.s3_client(
        aws_access_key_id=st.secrets["AWS_ACCESS_KEY"],
        aws_secret_access_key=st.secrets["AWS_SECRET_KEY"],
        region_name=st.secrets.get("AWS_REGION", "us-east-2")
    )
-   s3.put_object(
-       Bucket=st.secrets["S3_BUCKET_NORMAL"],
-       Key=f"to-process/{filename}.txt",
-       Body=filename.encode('utf-8')
+   # The trigger body carries the correlation id and submit time so the worker
+   # can attribute its queue wait and spans to this upload, and the panel's
+   # urgency so the worker can order its queue without downloading panels
+   body = json.dumps({
+       'filename': filename,
+       'correlation_id': correlation_id,
+       'submitted_at': time.time(),
+       'severity': severity
+   })
+   with metrics.span('trigger_write', correlation_id=correlation_id):
+       s3.put_object(
+           Bucket=st.secrets["S3_BUCKET_NORMAL"],
+           Key=f"to-process/{filename}.txt",
+           Body=body.encode('utf-8')
+       )
+
+
+def _already_summarized(s3, object_key):
+   """True if a summary exists or is already queued for these bytes"""
+   bucket = st.secrets["S3_BUCKET_NORMAL"]
+   return (ingest.object_exists(s3, bucket, f"summaries/{object_key}-summary.txt")
+           or ingest.object_exists(s3, bucket, f"to-process/{object_key}.txt"))
+
+
+def _panel_severity(file_bytes):
+   """scheduler.severity_score of an uploaded CSV, or 0 if it can't be read"""
+   try:
+       df, _ = schema.read_bloodwork_csv(file_bytes)
+       return scheduler.severity_score(df)
+   except Exception:
+       return 0.0
+
+
+def _upload_then_trigger(job, file_bytes, bucket, aws_access_key, aws_secret_key, region):
+   """
+   Background half of submit_upload. Stores the raw file under its content
+   key, confirms it landed, and only then writes the EC2 trigger so the worker
+   never sees a trigger for a missing object. Bytes that were uploaded before
+   skip the upload, and also the trigger if they were already summarized or
+   queued. Progress is reported through job['stage'].
+   """
+   correlation_id = job['correlation_id']
+   try:
+       job['stage'] = 'uploading'
+       s3 = resilience.s3_client(
+           aws_access_key_id=aws_access_key,
+           aws_secret_access_key=aws_secret_key,
+           region_name=region
+       )
+       with metrics.span('s3_upload', correlation_id=correlation_id):
+           _, created = ingest.store(s3, bucket, file_bytes, job['uploader'], job['filename'],
+                                     {metrics.CORRELATION_METADATA_KEY: correlation_id},
+                                     manifest_bucket=st.secrets["S3_BUCKET_NORMAL"])
+           s3.head_object(Bucket=bucket, Key=job['object_key'])
+       metrics.inc('ingest_uploads_total', status='new' if created else 'duplicate')
+
+       if not created and _already_summarized(s3, job['object_key']):
+           job['deduplicated'] = True
+       else:
+           job['stage'] = 'triggering'
+           notify_ec2_to_process(job['object_key'], correlation_id, _panel_severity(file_bytes))
+       job['stage'] = 'done'
+   except Exception as e:
+       job['error'] = str(e)
+       job['stage'] = 'failed'
+   return job
+
+
+def submit_upload(filename, file_bytes):
+   """
+   Queues the upload and trigger for a file once per session and returns the
+   job dict kept in session state. A failed job is resubmitted on request.
+   """
+   jobs = st.session_state.setdefault('upload_jobs', {})
+   uploader = st.session_state.setdefault('uploader_id', uuid.uuid4().hex)
+   job_key = ingest.content_hash(file_bytes)
+   job = jobs.get(job_key)
+   if job is not None and not (job['stage'] == 'failed' and job.get('retry')):
+       return job
+
+   job = {
+       'filename': filename,
+       'uploader': uploader,
+       'object_key': ingest.content_key(job_key),
+       'correlation_id': metrics.new_correlation_id(),
+       'stage': 'queued',
+       'error': None,
+   }
+   jobs[job_key] = job
+   _background.submit(
+       _upload_then_trigger,
+       job,
+       file_bytes,
+       st.secrets["S3_BUCKET_RAW"],
+       st.secrets["AWS_ACCESS_KEY"],
+       st.secrets["AWS_SECRET_KEY"],
+       st.secrets.get("AWS_REGION", "us-east-1")
    )
+   return job
+
+
+def _upload_status_panel(job):
+   stage = job['stage']
+   if stage == 'done' and job.get('deduplicated'):
+       st.success("🔒 This file was already analyzed; reusing the stored results")
+   elif stage == 'done':
+       st.success("🔒 File securely stored in cloud database")
+   elif stage == 'failed':
+       st.error(f"Failed to upload to S3: {job['error']}")
+       if st.button("Retry upload", key=f"retry_{job['correlation_id']}"):
+           job['retry'] = True
+           st.rerun()
+   else:
+       st.caption(f"☁️ Uploading file to secure cloud storage... ({stage})")
+
+
+# Re-render just the status panel while the upload is in flight, where supported
+if hasattr(st, 'fragment'):
+   upload_status_panel = st.fragment(run_every=2)(_upload_status_panel)
+else:
+   upload_status_panel = _upload_status_panel
+
+
+# Reports are built on the background pool and kept by content hash, shared by all sessions
+@st.cache_resource
+def get_report_builder():
+   return reports.ReportBuilder(_background)
+
+
+def request_report(df, plot_png, summary):
+   """Queues the downloadable report for these inputs and returns its digest"""
+   try:
+       s3, bucket = get_summary_s3_client(), st.secrets["S3_BUCKET_NORMAL"]
+   except Exception:
+       # No S3 credentials (e.g. local demo): keep the report in process only
+       s3, bucket = None, None
+   return get_report_builder().request(df, plot_png, summary, classify_results, s3=s3, bucket=bucket)
+
+
+def _report_panel(df, plot_png, summary, filename, summary_object_key=None):
+   """
+   Download button for the report once the background build has finished.
+   With summary_object_key, the newest summary polled for that upload is
+   used, so the report picks up the AI summary as soon as it lands.
+   """
+   if summary_object_key is not None:
+       polled = st.session_state.get(f"summary_poll:{summary_object_key}", {}).get('summary')
+       summary = polled if polled is not None else summary
+   digest = request_report(df, plot_png, summary)
+   try:
+       data = get_report_builder().result(digest)
+   except Exception as e:
+       st.error(f"Could not build the report: {e}")
+       return
+   if data is None:
+       st.caption("📄 Preparing your downloadable report...")
+       return
+   st.download_button(
+       "📥 Download analysis report",
+       data=data,
+       file_name=f"{filename.rsplit('.', 1)[0]}-analysis.html",
+       mime="text/html",
+       key=f"report_{digest}"
+   )
+
+
+if hasattr(st, 'fragment'):
+   report_panel = st.fragment(run_every=1)(_report_panel)
+else:
+   report_panel = _report_panel
 
 
 # Main UI Function
 def main():
+   profiler = profiling.begin_rerun()
+   try:
+       _render_page(profiler)
+   finally:
+       # st.stop(), st.rerun() and errors skip finish(); don't leave the profiler enabled
+       profiler.stop()
+       metrics.flush()
+
+
+def _render_page(profiler):
    st.set_page_config(
        page_title="HealthInsight - Bloodwork Analyzer",
        page_icon="🩸",
        layout="wide",
        initial_sidebar_state="expanded",
    )
+   profiler.activate()
+   profiler.checkpoint('page_config')
 
 
    # Custom CSS for styling
@@ -463,6 +838,7 @@ def main():
        }
    </style>
    """, unsafe_allow_html=True)
+   profiler.checkpoint('custom_css')
 
 
    # Sidebar
@@ -549,6 +925,7 @@ def main():
                <span class="glossary-term">HDL:</span> High-Density Lipoprotein - often called "good cholesterol"
            </div>
            """, unsafe_allow_html=True)
+   profiler.checkpoint('sidebar')
 
 
    # Main UI
@@ -574,6 +951,7 @@ def main():
        <p>Upload a CSV with test names, results, and reference ranges to visualize and better understand your health data.</p>
    </div>
    """, unsafe_allow_html=True)
+   profiler.checkpoint('header')
 
 
    # File upload section with better styling
@@ -584,6 +962,7 @@ def main():
   
    with upload_col2:
        use_sample = st.checkbox("Use sample data", help="Use our sample data if you don't have a CSV file")
+   profiler.checkpoint('upload_widgets')
 
 
    df = None
@@ -591,35 +970,25 @@ def main():
 
    if uploaded_file or use_sample:
        if uploaded_file:
-           notify_ec2_to_process(uploaded_file.name)
-
-
            st.success("✅ File successfully uploaded!")
-           file_bytes = uploaded_file.read()
-           file_buffer = io.BytesIO(file_bytes)
+           file_bytes = uploaded_file.getvalue()
 
 
-           # Upload to S3
-           with st.spinner("☁️ Uploading file to secure cloud storage..."):
-               success = upload_to_s3(
-                   file_buffer=file_buffer,
-                   filename=uploaded_file.name,
-                   bucket=st.secrets["S3_BUCKET_RAW"],
-                   aws_access_key=st.secrets["AWS_ACCESS_KEY"],
-                   aws_secret_key=st.secrets["AWS_SECRET_KEY"],
-                   region=st.secrets.get("AWS_REGION", "us-east-1")
-               )
-
-
-               if success:
-                   st.success("🔒 File securely stored in cloud database")
+           # Upload and EC2 trigger run in the background; the analysis below renders right away
+           upload_job = submit_upload(uploaded_file.name, file_bytes)
+           correlation_id = upload_job['correlation_id']
+           upload_status_panel(upload_job)
+           alerts_panel(upload_job['object_key'], correlation_id)
 
 
            # Read CSV
            with st.spinner("🔍 Processing your bloodwork data..."):
                try:
-                   df = pd.read_csv(io.BytesIO(file_bytes))
+                   df, read_issues = schema.read_bloodwork_csv(file_bytes)
                    st.success(f"📊 Successfully analyzed {len(df)} test results")
+                   if read_issues:
+                       st.warning(f"⚠️ {len(read_issues)} row(s) could not be read cleanly and were skipped "
+                                  f"or left blank:\n\n{schema.format_issues(read_issues)}")
                except Exception as e:
                    st.error(f"❌ Error reading CSV: {e}")
                    st.stop()
@@ -627,50 +996,15 @@ def main():
 
        elif use_sample:
            st.info("🧪 Using sample bloodwork data...")
-           # Create loading animation
-           display_loading_animation("Preparing sample data...")
-           time.sleep(1)
-          
-           df = pd.DataFrame({
-               'panel_category': [
-                   'CBC', 'CBC', 'CBC',
-                   'CMP', 'CMP', 'CMP',
-                   'Lipid Panel', 'Lipid Panel', 'Lipid Panel', 'Lipid Panel',
-                   'Vitamins', 'Hormones'
-               ],
-               'test_name': [
-                   'Hemoglobin', 'White Blood Cells', 'Platelets',
-                   'Glucose', 'ALT', 'Creatinine',
-                   'Total Cholesterol', 'HDL Cholesterol', 'LDL Cholesterol', 'Triglycerides',
-                   'Vitamin D', 'TSH'
-               ],
-               'date': ['2023-05-15'] * 12,
-               'value': [14.2, 6.8, 250.0,
-                        92.0, 25.0, 0.9,
-                        185.0, 55.0, 110.0, 120.0,
-                        38.0, 2.5],
-               'unit': ['g/dL', 'k/μL', 'k/μL',
-                       'mg/dL', 'U/L', 'mg/dL',
-                       'mg/dL', 'mg/dL', 'mg/dL', 'mg/dL',
-                       'ng/mL', 'mIU/L'],
-               'reference_range': [
-                   '13.0-17.0', '4.5-11.0', '150.0-450.0',
-                   '70.0-99.0', '7.0-55.0', '0.6-1.2',
-                   '< 200.0', '> 40.0', '< 130.0', '< 150.0',
-                   '30.0-100.0', '0.4-4.0'
-               ]
-           })
-
-
-           sample_buffer = io.BytesIO(df.to_csv(index=False).encode('utf-8'))
-           upload_to_s3(
-               sample_buffer,
-               filename="sample_data.csv",
-               bucket=st.secrets["S3_BUCKET_NORMAL"],
-               aws_access_key=st.secrets["AWS_ACCESS_KEY"],
-               aws_secret_key=st.secrets["AWS_SECRET_KEY"]
-           )
-           st.success("📤 Sample data uploaded to S3")
+           df = SAMPLE_DATA
+
+           # Upload runs in the background and is skipped when S3 already has it
+           sample_upload = ensure_sample_uploaded()
+           if not sample_upload.done():
+               st.caption("📤 Uploading sample data to S3 in the background...")
+           elif sample_upload.exception() is None:
+               st.success("📤 Sample data uploaded to S3")
+       profiler.checkpoint('load_data')
 
 
        # Data Preview with nicer formatting
@@ -682,6 +1016,7 @@ def main():
       
        # Apply custom formatting to dataframe
        st.dataframe(df, use_container_width=True)
+       profiler.checkpoint('data_preview')
       
        # Button with better styling
        if st.button("Generate Visualizations and Summary", key="generate_button", help="Click to analyze your bloodwork data"):
@@ -729,38 +1064,7 @@ def main():
                # Create a more visually informative table
                if 'reference_range' in filtered_df.columns:
                    # Create a status column
-                   result_df = filtered_df.copy()
-                   result_df['status'] = ""
-                  
-                   for i, row in result_df.iterrows():
-                       try:
-                           range_str = row['reference_range']
-                           value = row['value']
-                          
-                           if '<' in range_str:
-                               threshold = float(range_str.replace('<', '').strip())
-                               if value <= threshold:
-                                   result_df.at[i, 'status'] = "✅ Normal"
-                               else:
-                                   result_df.at[i, 'status'] = "⚠️ High"
-                           elif '>' in range_str:
-                               threshold = float(range_str.replace('>', '').strip())
-                               if value >= threshold:
-                                   result_df.at[i, 'status'] = "✅ Normal"
-                               else:
-                                   result_df.at[i, 'status'] = "⚠️ Low"
-                           elif '-' in range_str:
-                               lower, upper = map(float, range_str.split('-'))
-                               if value < lower:
-                                   result_df.at[i, 'status'] = "⚠️ Low"
-                               elif value > upper:
-                                   result_df.at[i, 'status'] = "⚠️ High"
-                               else:
-                                   result_df.at[i, 'status'] = "✅ Normal"
-                           else:
-                               result_df.at[i, 'status'] = "❓ Unknown"
-                       except:
-                           result_df.at[i, 'status'] = "❓ Unknown"
+                   result_df = classify_results(filtered_df)
                   
                    # Display the styled dataframe
                    display_cols = ['test_name', 'value', 'unit', 'reference_range', 'status']
@@ -768,6 +1072,7 @@ def main():
                        display_cols = ['panel_category'] + display_cols
                   
                    st.dataframe(result_df[display_cols], use_container_width=True)
+               profiler.checkpoint('analysis_tab')
           
            with tab2:
                summary = ""
@@ -775,15 +1080,7 @@ def main():
                    st.markdown("### 💬 AI-Generated Summary")
                    st.info("Looking for AI analysis of your bloodwork...")
                   
-                   summary = load_summary_from_s3(uploaded_file.name)
-                   st.markdown(f"""
-                   <div style="background-color: white; padding: 20px; border-radius: 10px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);">
-                       <h4 style="color: #3498db; margin-top: 0;">Healthcare AI Analysis</h4>
-                       <div style="margin-top: 15px; white-space: pre-line; color: #2c3e50;">
-                           {summary}
-                       </div>
-                   </div>
-                   """, unsafe_allow_html=True)
+                   summary = summary_panel(upload_job['object_key'], correlation_id)
                else:
                    # Sample summary for demo purposes
                    st.markdown("### 💬 AI-Generated Summary")
@@ -826,7 +1123,7 @@ def main():
               
                # Save plot and summary to database
                plot_buf = generate_result_plot(df)
-               save_to_rds(summary, plot_buf.getvalue(), uploaded_file.name if uploaded_file else "sample_data.csv")
+               save_to_rds(summary, plot_buf.getvalue(), uploaded_file.name if uploaded_file else SAMPLE_FILENAME)
               
                st.success("✅ Analysis complete! Summary and visualizations saved to database.")
               
@@ -845,6 +1142,10 @@ def main():
                    </div>
                </div>
                """, unsafe_allow_html=True)
+               report_panel(df, plot_buf.getvalue(), summary,
+                            uploaded_file.name if uploaded_file else SAMPLE_FILENAME,
+                            upload_job['object_key'] if uploaded_file else None)
+               profiler.checkpoint('summary_tab')
 
 
    else:
@@ -901,6 +1202,7 @@ def main():
            </div>
        </div>
        """, unsafe_allow_html=True)
+       profiler.checkpoint('placeholder')
 
 
    # Footer with disclaimer
@@ -910,6 +1212,8 @@ def main():
        <p>© 2025 HealthInsight - Bloodwork Analyzer</p>
    </div>
    """, unsafe_allow_html=True)
+   profiler.checkpoint('footer')
+   profiler.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,374 @@
+"""
+Benchmark harness for the bloodwork pipeline.
+
+Generates synthetic panels from the test-name variants and unit alternates that
+preproc.py knows how to normalize, then times the hot paths at increasing row
+counts. Results are written as JSON so two versions can be compared.
+
+Usage:
+    python benchmark.py --sizes 10,1000,100000 --output bench.json
+    python benchmark.py --sizes 10,1000000,10000000 --scenarios preprocess,convert_value
+    python benchmark.py --output new.json --compare old.json
+    python benchmark.py --scenarios preprocess --prompt-cache   # needs a running ollama
+"""
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The dashboard (streamlit.py in this directory) would shadow the streamlit package
+sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != HERE] + [HERE]
+
+from preproc import convert_value, preprocess_bloodwork_data, target_units, test_name_mapping
+
+DEFAULT_SIZES = [10, 1000, 100_000]
+FIELDNAMES = ['panel_category', 'test_name', 'date', 'value', 'unit', 'reference_range']
+
+# canonical test -> (panel, mean, sd, reference range) in the target unit
+TEST_PROFILES = {
+    'WBC': ('CBC', 7.0, 2.0, '4.0 - 11.0'),
+    'RBC': ('CBC', 4.9, 0.5, '4.2 - 5.9'),
+    'Hemoglobin': ('CBC', 14.5, 1.5, '13.5 - 17.5'),
+    'Glucose': ('CMP', 92.0, 15.0, '70 - 99'),
+    'Calcium': ('CMP', 9.4, 0.5, '8.6 - 10.2'),
+    'Sodium': ('CMP', 140.0, 3.0, '135 - 145'),
+    'Potassium': ('CMP', 4.3, 0.5, '3.5 - 5.1'),
+    'Total Cholesterol': ('Lipid Panel', 190.0, 35.0, '< 200'),
+    'LDL Cholesterol': ('Lipid Panel', 110.0, 30.0, '< 100'),
+    'HDL Cholesterol': ('Lipid Panel', 52.0, 12.0, '> 40'),
+    'TSH': ('Thyroid Panel', 2.0, 1.0, '0.4 - 4.0'),
+    'Free T4': ('Thyroid Panel', 1.3, 0.3, '0.8 - 1.8'),
+}
+
+# canonical test -> [(reported unit, multiplier from the target unit)]
+UNIT_VARIANTS = {
+    'WBC': [('10^3/uL', 1.0), ('x10^3/uL', 1.0), ('x10^9/L', 1.0)],
+    'RBC': [('10^6/uL', 1.0), ('x10^6/uL', 1.0), ('x10^12/L', 1.0)],
+    'Glucose': [('mg/dL', 1.0), ('mmol/L', 1 / 18.0)],
+    'Calcium': [('mg/dL', 1.0), ('mmol/L', 1 / 4.0)],
+    'Free T4': [('ng/dL', 1.0), ('pmol/L', 12.87)],
+    'TSH': [('mIU/L', 1.0), ('uIU/mL', 1.0)],
+    'Potassium': [('mmol/L', 1.0)],
+}
+
+
+def _name_variants():
+    """canonical test -> raw spellings seen in exports, built from preproc's mapping"""
+    variants = {}
+    for raw, canonical in test_name_mapping.items():
+        variants.setdefault(canonical, []).extend([raw, raw.title()])
+    variants.setdefault('Potassium', ['POTASSIUM', 'Potassium'])
+    return variants
+
+
+NAME_VARIANTS = _name_variants()
+
+
+def iter_synthetic_rows(n_rows, seed=0):
+    """
+    Yields n_rows raw bloodwork rows. Rows come in per-patient panels with a
+    shared date, mixing name spellings and unit variants the way real exports do.
+    """
+    rng = random.Random(seed)
+    tests = list(TEST_PROFILES)
+    start = date(2020, 1, 1)
+    produced = 0
+    while produced < n_rows:
+        drawn_on = (start + timedelta(days=rng.randrange(2000))).isoformat()
+        for test in tests:
+            if produced >= n_rows:
+                return
+            panel, mean, sd, ref_range = TEST_PROFILES[test]
+            unit, factor = rng.choice(UNIT_VARIANTS.get(test, [(target_units.get(test, ''), 1.0)]))
+            value = max(0.01, rng.gauss(mean, sd)) * factor
+            yield {
+                'panel_category': panel,
+                'test_name': rng.choice(NAME_VARIANTS[test]),
+                'date': drawn_on,
+                'value': f"{value:.2f}",
+                'unit': unit,
+                'reference_range': ref_range,
+            }
+            produced += 1
+
+
+def synthetic_csv_bytes(n_rows, seed=0):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDNAMES)
+    writer.writeheader()
+    writer.writerows(iter_synthetic_rows(n_rows, seed))
+    return buffer.getvalue().encode('utf-8')
+
+
+def synthetic_dataframe(n_rows, seed=0):
+    """Normalized synthetic panel as the dashboard sees it (numeric value column)"""
+    import pandas as pd
+    rows = preprocess_bloodwork_data(io.BytesIO(synthetic_csv_bytes(n_rows, seed)))
+    return pd.DataFrame({name: rows.column(name) for name in FIELDNAMES}, columns=FIELDNAMES)
+
+
+# name -> (setup(n_rows) -> state, run(state), max_rows)
+SCENARIOS = {}
+
+
+def scenario(name, max_rows=None):
+    def register(fn):
+        SCENARIOS[name] = (fn, max_rows)
+        return fn
+    return register
+
+
+@scenario('preprocess')
+def _preprocess(n_rows):
+    payload = synthetic_csv_bytes(n_rows)
+    return lambda: preprocess_bloodwork_data(io.BytesIO(payload))
+
+
+@scenario('serialize')
+def _serialize(n_rows):
+    rows = preprocess_bloodwork_data(io.BytesIO(synthetic_csv_bytes(n_rows)))
+    return lambda: rows.write_csv(io.StringIO())
+
+
+@scenario('convert_value')
+def _convert_value(n_rows):
+    args = []
+    for row in iter_synthetic_rows(n_rows):
+        test = test_name_mapping.get(row['test_name'].strip().upper(), row['test_name'])
+        args.append((row['value'], row['unit'], target_units.get(test, row['unit']), test))
+
+    def run():
+        for value, from_unit, to_unit, test in args:
+            convert_value(value, from_unit, to_unit, test)
+    return run
+
+
+@scenario('app.classify_results')
+def _classify_results(n_rows):
+    import app
+    df = synthetic_dataframe(n_rows)
+    return lambda: app.classify_results(df)
+
+
+@scenario('app.create_range_status_visualization', max_rows=1_000_000)
+def _range_status(n_rows):
+    import app
+    df = synthetic_dataframe(n_rows)
+    return lambda: app.create_range_status_visualization(df)
+
+
+@scenario('app.create_panel_distribution', max_rows=1_000_000)
+def _panel_distribution(n_rows):
+    import app
+    df = synthetic_dataframe(n_rows)
+    return lambda: app.create_panel_distribution(df)
+
+
+@scenario('app.generate_result_plot', max_rows=10_000)
+def _result_plot(n_rows):
+    import app
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    df = synthetic_dataframe(n_rows)
+
+    def run():
+        app.generate_result_plot(df)
+        plt.close('all')
+    return run
+
+
+@scenario('app.create_test_gauge_charts', max_rows=1000)
+def _gauge_charts(n_rows):
+    import app
+    df = synthetic_dataframe(n_rows)
+    return lambda: app.create_test_gauge_charts(df)
+
+
+@scenario('prompts.build_messages', max_rows=1_000_000)
+def _build_messages(n_rows):
+    import prompts
+    df = synthetic_dataframe(n_rows)
+    return lambda: prompts.build_messages(df)
+
+
+@scenario('ec2.summarize_stub', max_rows=100_000)
+def _summarize_stub(n_rows):
+    import ec2
+    import llm
+    df = synthetic_dataframe(n_rows)
+    backend = llm.StubBackend()
+    return lambda: ec2.summarize_panel(df, backend)
+
+
+def time_scenario(name, n_rows, repeats):
+    setup, max_rows = SCENARIOS[name]
+    result = {'scenario': name, 'rows': n_rows}
+    if max_rows is not None and n_rows > max_rows:
+        result['skipped'] = f"above max_rows={max_rows}"
+        return result
+    try:
+        run = setup(n_rows)
+    except ImportError as e:
+        result['skipped'] = f"missing dependency: {e}"
+        return result
+    except Exception as e:
+        # One broken scenario shouldn't cost the results of the others
+        result['skipped'] = f"setup failed: {type(e).__name__}: {e}"
+        return result
+
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+
+    median = statistics.median(timings)
+    result.update({
+        'repeats': repeats,
+        'min_s': min(timings),
+        'median_s': median,
+        'mean_s': statistics.fmean(timings),
+        'rows_per_s': n_rows / median if median else None,
+    })
+    return result
+
+
+def prompt_cache_benchmark(backend, n_jobs=8, rows_per_job=12):
+    """
+    Compares prompt-evaluation time across a run of distinct panels with the
+    shared system prefix (reusable KV cache) and with the data-first layout
+    (no shared prefix). Needs a real model server; reports medians in seconds.
+    """
+    import prompts
+    panels = [synthetic_dataframe(rows_per_job, seed=i) for i in range(n_jobs)]
+    report = {}
+    for layout, build in (('no_reuse', prompts.build_messages_without_prefix),
+                          ('prefix_reuse', prompts.build_messages)):
+        # First call primes the cache for the layout; it is not counted
+        backend.chat(build(panels[0]))
+        prompt_eval, wall = [], []
+        for df in panels[1:]:
+            result = backend.chat(build(df))
+            wall.append(result.seconds)
+            if result.prompt_eval_seconds is not None:
+                prompt_eval.append(result.prompt_eval_seconds)
+        report[layout] = {
+            'jobs': len(wall),
+            'median_wall_s': statistics.median(wall),
+            'median_prompt_eval_s': statistics.median(prompt_eval) if prompt_eval else None,
+        }
+        print(f"{layout:14s} prompt eval {report[layout]['median_prompt_eval_s']} s, "
+              f"wall {report[layout]['median_wall_s']:.3f} s")
+    return report
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, repeats=3):
+    names = names or list(SCENARIOS)
+    results = []
+    for name in names:
+        for n_rows in sizes:
+            # Very large inputs get a single pass; the run is long enough to be stable
+            result = time_scenario(name, n_rows, 1 if n_rows >= 1_000_000 else repeats)
+            results.append(result)
+            if 'skipped' in result:
+                print(f"{name:40s} {n_rows:>10d} rows  skipped ({result['skipped']})")
+            else:
+                print(f"{name:40s} {n_rows:>10d} rows  {result['median_s'] * 1000:10.2f} ms  "
+                      f"{result['rows_per_s']:14.0f} rows/s")
+    return {
+        'meta': {
+            'revision': _git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.10):
+    """
+    Prints the median-time ratio of every scenario present in both runs and
+    returns the list of regressions slower than baseline by more than threshold.
+    """
+    previous = {(r['scenario'], r['rows']): r for r in baseline['results'] if 'median_s' in r}
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('revision')}:")
+    for r in current['results']:
+        old = previous.get((r['scenario'], r['rows']))
+        if old is None or 'median_s' not in r:
+            continue
+        ratio = r['median_s'] / old['median_s'] if old['median_s'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append({'scenario': r['scenario'], 'rows': r['rows'], 'ratio': ratio})
+        print(f"{r['scenario']:40s} {r['rows']:>10d} rows  x{ratio:6.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the bloodwork pipeline hot paths on synthetic data.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated row counts (10 up to 10000000)")
+    parser.add_argument('--scenarios', default=None,
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help="Write results JSON here")
+    parser.add_argument('--compare', default=None, help="Baseline results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed slowdown before flagging")
+    parser.add_argument('--prompt-cache', action='store_true',
+                        help="Also compare prompt-eval time with and without prefix reuse (needs ollama)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    names = args.scenarios.split(',') if args.scenarios else None
+    unknown = set(names or []) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(sizes, names, args.repeats)
+    if args.prompt_cache:
+        import llm
+        # One generated token keeps the timing dominated by prompt evaluation
+        backend = llm.OllamaBackend(model=os.environ.get('LLM_MODEL', llm.DEFAULT_MODEL),
+                                    options={'num_predict': 1})
+        backend.warm_up()
+        report['prompt_cache'] = prompt_cache_benchmark(backend)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(report, baseline, args.threshold)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        return 1 if report['regressions'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Bulk backfill of historical bloodwork CSVs.
+
+Walks a local directory or an S3 prefix, runs preprocess_bloodwork_data across a
+process pool and writes the normalized rows out in large batches. Finished files
+are recorded in a checkpoint manifest so an interrupted run picks up where it
+stopped instead of starting over.
+
+Usage:
+    python bulk_ingest.py ./exports --output ./normalized
+    python bulk_ingest.py s3://raw-bloodtest-upload-sk/history/ \
+        --output s3://processed-bloodtest-data-sk/processed/ --workers 8
+"""
+import argparse
+import csv
+import fnmatch
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import resilience
+import storage
+from preproc import preprocess_bloodwork_data
+
+DEFAULT_BATCH_ROWS = 100_000
+DEFAULT_MANIFEST = 'bulk_ingest_manifest.json'
+
+# One S3 client per process, created lazily. The parent's client (used for
+# listing and writing) is dropped in each worker by _reset_s3, since boto3
+# clients and their connection pools aren't safe to share across a fork.
+_s3 = None
+
+
+def _get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = resilience.s3_client()
+    return _s3
+
+
+def _reset_s3():
+    """Pool initializer: forget any client inherited from the parent"""
+    global _s3
+    _s3 = None
+
+
+def split_s3_uri(uri):
+    """Split 's3://bucket/prefix' into (bucket, prefix)."""
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix
+
+
+def list_sources(source, pattern='*.csv'):
+    """
+    Returns the sorted list of input files under a local directory or S3 prefix.
+    S3 inputs are returned as full s3:// URIs.
+    """
+    if source.startswith('s3://'):
+        bucket, prefix = split_s3_uri(source)
+        paginator = _get_s3().get_paginator('list_objects_v2')
+        keys = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if fnmatch.fnmatch(os.path.basename(obj['Key']), pattern):
+                    keys.append(f"s3://{bucket}/{obj['Key']}")
+        return sorted(keys)
+
+    paths = []
+    for root, _, files in os.walk(source):
+        for name in files:
+            if fnmatch.fnmatch(name, pattern):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def process_source(source_id):
+    """
+    Worker entry point. Returns (source_id, rows, error) so a single bad file
+    never takes down the pool.
+    """
+    try:
+        if source_id.startswith('s3://'):
+            bucket, key = split_s3_uri(source_id)
+            response = _get_s3().get_object(Bucket=bucket, Key=key)
+            rows = preprocess_bloodwork_data(storage.open_body(response))
+        else:
+            with open(source_id, 'rb') as f:
+                rows = preprocess_bloodwork_data(f)
+        rows.add_column('source_file', source_id)
+        return source_id, rows, None
+    except Exception as e:
+        return source_id, [], f"{type(e).__name__}: {e}"
+
+
+class Manifest:
+    """
+    Checkpoint of completed and failed inputs. Saved atomically so a crash
+    mid-write never leaves a truncated manifest behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        self.failed = {}
+        self.parts = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.completed = set(state.get('completed', []))
+            self.failed = state.get('failed', {})
+            self.parts = state.get('parts', 0)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'completed': sorted(self.completed),
+                'failed': self.failed,
+                'parts': self.parts,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+class BatchWriter:
+    """
+    Buffers normalized rows and writes them out as numbered CSV parts.
+    Inputs are only marked complete in the manifest once their rows have been
+    flushed, so resuming never drops or duplicates a file's output.
+    """
+
+    def __init__(self, output, manifest, batch_rows=DEFAULT_BATCH_ROWS):
+        self.output = output
+        self.manifest = manifest
+        self.batch_rows = batch_rows
+        self.tables = []
+        self.row_count = 0
+        self.pending_sources = []
+        self.fieldnames = None
+        if not output.startswith('s3://'):
+            os.makedirs(output, exist_ok=True)
+
+    def add(self, source_id, rows):
+        """rows is the NormalizedRows table for one input; it is kept as is until flushed"""
+        if rows and self.fieldnames is None:
+            self.fieldnames = list(rows.fieldnames)
+        if rows:
+            self.tables.append(rows)
+            self.row_count += len(rows)
+        self.pending_sources.append(source_id)
+        if self.row_count >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.tables:
+            # Columns missing from a file are written empty, extra ones dropped
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(self.fieldnames)
+            for table in self.tables:
+                writer.writerows(table.iter_rows(self.fieldnames))
+            self._write_part(f"part-{self.manifest.parts + 1:05d}.csv", buffer.getvalue())
+            self.manifest.parts += 1
+
+        if self.pending_sources:
+            self.manifest.completed.update(self.pending_sources)
+            self.manifest.save()
+
+        self.tables = []
+        self.row_count = 0
+        self.pending_sources = []
+
+    def _write_part(self, name, body):
+        if self.output.startswith('s3://'):
+            bucket, prefix = split_s3_uri(self.output)
+            key = f"{prefix.rstrip('/')}/{name}" if prefix else name
+            storage.put_object(_get_s3(), bucket, key, body)
+        else:
+            with open(os.path.join(self.output, name), 'w', newline='') as f:
+                f.write(body)
+
+
+def run(source, output, manifest_path=DEFAULT_MANIFEST, workers=None,
+        batch_rows=DEFAULT_BATCH_ROWS, pattern='*.csv', progress_every=2.0):
+    manifest = Manifest(manifest_path)
+    sources = [s for s in list_sources(source, pattern) if s not in manifest.completed]
+    total = len(sources)
+    print(f"[ingest] {total} files to process ({len(manifest.completed)} already done)")
+    if not total:
+        return manifest
+
+    writer = BatchWriter(output, manifest, batch_rows)
+    started = time.perf_counter()
+    last_report = started
+    files_done = rows_done = failures = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_reset_s3) as pool:
+        chunksize = max(1, min(64, total // ((workers or os.cpu_count() or 1) * 4)))
+        try:
+            for source_id, rows, error in pool.map(process_source, sources, chunksize=chunksize):
+                files_done += 1
+                if error:
+                    failures += 1
+                    manifest.failed[source_id] = error
+                    print(f"[ingest] failed {source_id}: {error}", file=sys.stderr)
+                    continue
+                manifest.failed.pop(source_id, None)
+                rows_done += len(rows)
+                writer.add(source_id, rows)
+
+                now = time.perf_counter()
+                if now - last_report >= progress_every:
+                    elapsed = now - started
+                    print(f"[ingest] {files_done}/{total} files, {rows_done} rows, "
+                          f"{files_done / elapsed:.1f} files/s, {rows_done / elapsed:.0f} rows/s")
+                    last_report = now
+        finally:
+            # Persist whatever finished so a Ctrl-C or crash can resume from here
+            writer.flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"[ingest] done: {files_done} files, {rows_done} rows, {failures} failed "
+          f"in {elapsed:.1f}s ({files_done / elapsed:.1f} files/s, {rows_done / elapsed:.0f} rows/s)")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-normalize bloodwork CSVs from a directory or S3 prefix.")
+    parser.add_argument('source', help="Local directory or s3://bucket/prefix to read from")
+    parser.add_argument('--output', required=True, help="Local directory or s3://bucket/prefix for normalized parts")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help="Checkpoint manifest path (used to resume)")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help="Rows per output part")
+    parser.add_argument('--pattern', default='*.csv', help="Filename glob to include")
+    args = parser.parse_args(argv)
+
+    manifest = run(args.source, args.output, args.manifest, args.workers,
+                   args.batch_rows, args.pattern)
+    return 1 if manifest.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Exactly-once harness for the ec2.py job-claim protocol.
+
+Runs N worker threads against an in-process S3 stand-in (moto) with the stub
+LLM backend. Every file has a trigger queued, and one file also has a stale
+lease left by a "crashed" worker. The harness asserts that every file was
+summarized exactly once, the stale lease was reclaimed, and no triggers or
+leases are left behind.
+
+Usage:
+    python claim_harness.py --workers 8 --files 200 --latency 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Short leases so the stale-lease reclaim path runs within the test
+os.environ.setdefault('LEASE_SECONDS', '2')
+
+import boto3
+from moto import mock_aws
+
+import ec2
+import leases
+import llm
+from benchmark import synthetic_csv_bytes
+
+
+class RecordingStub(llm.StubBackend):
+    """Stub backend that records which panel each call summarized"""
+
+    def __init__(self, tally, lock, latency):
+        super().__init__(latency=latency)
+        self.tally = tally
+        self.lock = lock
+
+    def _chat(self, messages):
+        result = super()._chat(messages)
+        with self.lock:
+            self.tally[messages[-1]['content']] += 1
+        return result
+
+
+def _seed(s3, n_files, stale_lease):
+    s3.create_bucket(Bucket=ec2.bucket_raw)
+    s3.create_bucket(Bucket=ec2.bucket_proc)
+    for i in range(n_files):
+        filename = f"panel_{i:05d}.csv"
+        s3.put_object(Bucket=ec2.bucket_raw, Key=filename, Body=synthetic_csv_bytes(12, seed=i))
+        s3.put_object(Bucket=ec2.bucket_proc, Key=f"{ec2.trigger_prefix}{filename}.txt",
+                      Body=json.dumps({'filename': filename}).encode('utf-8'))
+    if stale_lease:
+        # Left behind by a worker that died mid-job
+        s3.put_object(Bucket=ec2.bucket_proc, Key=leases.lease_key('panel_00000.csv'),
+                      Body=json.dumps({'worker_id': 'crashed', 'expires_at': time.time() - 1}).encode('utf-8'))
+
+
+def _worker(tally, lock, latency, completed, errors):
+    try:
+        s3 = boto3.client('s3', region_name='us-east-1')
+        backend = RecordingStub(tally, lock, latency)
+        worker_id = leases.default_worker_id()
+        # Keep passing over the queue until it drains
+        while True:
+            done = ec2.run_worker(s3, backend, worker_id)
+            with lock:
+                completed[worker_id] = completed.get(worker_id, 0) + done
+            if not s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix=ec2.trigger_prefix).get('KeyCount'):
+                return
+            time.sleep(0.05)
+    except Exception as e:
+        errors.append(e)
+
+
+def run(n_workers=4, n_files=50, latency=0.0, stale_lease=True, verbose=False):
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        _seed(s3, n_files, stale_lease)
+
+        tally, completed, errors = Counter(), {}, []
+        lock = threading.Lock()
+        threads = [threading.Thread(target=_worker, args=(tally, lock, latency, completed, errors))
+                   for _ in range(n_workers)]
+
+        started = time.perf_counter()
+        quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        assert not errors, f"worker errors: {errors}"
+        summaries = s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix='summaries/').get('KeyCount', 0)
+        triggers = s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix=ec2.trigger_prefix).get('KeyCount', 0)
+        lease_objects = s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix=leases.LEASE_PREFIX).get('KeyCount', 0)
+
+        duplicates = {panel: count for panel, count in tally.items() if count > 1}
+        assert not duplicates, f"{len(duplicates)} panels summarized more than once"
+        assert len(tally) == n_files, f"expected {n_files} distinct panels summarized, got {len(tally)}"
+        assert sum(completed.values()) == n_files, f"workers reported {sum(completed.values())} completions"
+        assert summaries == n_files, f"expected {n_files} summaries, found {summaries}"
+        assert triggers == 0, f"{triggers} triggers left unprocessed"
+        assert lease_objects == 0, f"{lease_objects} leases left behind"
+
+    print(f"OK: {n_files} files summarized exactly once by {n_workers} workers in {elapsed:.2f}s "
+          f"({n_files / elapsed:.1f} files/s); per worker: {sorted(completed.values(), reverse=True)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check exactly-once job claiming across concurrent workers.")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument('--no-stale-lease', action='store_true', help="Skip the crashed-worker scenario")
+    parser.add_argument('--verbose', action='store_true', help="Show worker output")
+    args = parser.parse_args(argv)
+    run(args.workers, args.files, args.latency, not args.no_stale_lease, args.verbose)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Materialized views behind the streamlit.py dashboard.
+
+The dashboard used to load all of lab_results and aggregate it in pandas, so
+its load time grew with the table. It now reads three small materialized
+views instead:
+
+    dashboard_latest_results  latest value per (patient_id, test_name)
+    dashboard_status_counts   number of latest results per test and status
+    dashboard_explanations    distinct explanation texts
+
+Their size depends on the number of patients and tests, not on the number of
+results ever ingested. Each view has a unique index, so REFRESH ...
+CONCURRENTLY can rebuild it without blocking dashboard reads. Whatever loads
+lab_results should call refresh_views() after each batch, or run
+`python dashboard_views.py --refresh` on a schedule. refresh_if_stale()
+skips the refresh when the views were rebuilt less than min_interval
+seconds ago, so frequent small batches don't refresh on every insert.
+
+lab_results is expected to have patient_id, test_name, value, status,
+explanation and created_at columns.
+
+Usage:
+    python dashboard_views.py --create    # once, on the primary
+    python dashboard_views.py --refresh
+"""
+import argparse
+import sys
+import time
+
+VIEWS = ('dashboard_latest_results', 'dashboard_status_counts', 'dashboard_explanations')
+
+CREATE_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS dashboard_latest_results AS
+    SELECT DISTINCT ON (patient_id, test_name)
+           patient_id, test_name, value, status, created_at
+    FROM lab_results
+    ORDER BY patient_id, test_name, created_at DESC;
+CREATE UNIQUE INDEX IF NOT EXISTS dashboard_latest_results_key
+    ON dashboard_latest_results (patient_id, test_name);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS dashboard_status_counts AS
+    SELECT test_name, COALESCE(status, 'Unknown') AS status, COUNT(*) AS results
+    FROM dashboard_latest_results
+    GROUP BY test_name, COALESCE(status, 'Unknown');
+CREATE UNIQUE INDEX IF NOT EXISTS dashboard_status_counts_key
+    ON dashboard_status_counts (test_name, status);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS dashboard_explanations AS
+    SELECT DISTINCT md5(explanation) AS explanation_key, explanation
+    FROM lab_results
+    WHERE explanation IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS dashboard_explanations_key
+    ON dashboard_explanations (explanation_key);
+
+CREATE TABLE IF NOT EXISTS dashboard_refresh_log (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    refreshed_at timestamptz NOT NULL
+);
+"""
+
+# Backs DISTINCT ON in dashboard_latest_results, so the refresh doesn't sort the whole table
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS lab_results_patient_test_latest
+    ON lab_results (patient_id, test_name, created_at DESC);
+"""
+
+PATIENTS_SQL = "SELECT DISTINCT patient_id FROM dashboard_latest_results ORDER BY patient_id"
+LATEST_SQL = """
+SELECT test_name, value, status, created_at
+FROM dashboard_latest_results
+WHERE patient_id = %s
+ORDER BY test_name
+"""
+STATUS_COUNTS_SQL = "SELECT test_name, status, results FROM dashboard_status_counts ORDER BY test_name, status"
+EXPLANATIONS_SQL = "SELECT explanation FROM dashboard_explanations ORDER BY explanation"
+
+
+def create_views(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(INDEX_SQL)
+        cursor.execute(CREATE_SQL)
+    conn.commit()
+
+
+def refresh_views(conn, concurrently=True):
+    """Rebuilds the views in dependency order and records when"""
+    # CONCURRENTLY can't run inside a transaction block
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for view in VIEWS:
+                cursor.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{view}")
+            cursor.execute("""
+                INSERT INTO dashboard_refresh_log (id, refreshed_at) VALUES (true, now())
+                ON CONFLICT (id) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at
+            """)
+    finally:
+        conn.autocommit = previous_autocommit
+
+
+def refresh_if_stale(conn, min_interval=60.0):
+    """Refreshes unless the views were rebuilt in the last min_interval seconds. Returns True if it refreshed."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT EXTRACT(EPOCH FROM now() - refreshed_at) FROM dashboard_refresh_log")
+        row = cursor.fetchone()
+    conn.rollback()
+    if row is not None and row[0] is not None and float(row[0]) < min_interval:
+        return False
+    refresh_views(conn)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or refresh the dashboard's materialized views.")
+    parser.add_argument('--create', action='store_true', help="Create the views and supporting index")
+    parser.add_argument('--refresh', action='store_true', help="Refresh the views")
+    parser.add_argument('--min-interval', type=float, default=0.0,
+                        help="Skip the refresh if the views are younger than this many seconds")
+    args = parser.parse_args(argv)
+
+    from rdsconfig import RDS_CONFIG
+    import resilience
+
+    conn = resilience.connect_rds(**RDS_CONFIG)
+    try:
+        if args.create:
+            create_views(conn)
+            print("Created dashboard views")
+        if args.refresh:
+            started = time.perf_counter()
+            refreshed = refresh_if_stale(conn, args.min_interval)
+            print(f"Refreshed dashboard views in {time.perf_counter() - started:.2f}s" if refreshed
+                  else "Dashboard views are fresh; skipped refresh")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
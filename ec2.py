@@ -1,68 +1,174 @@
-
-import boto3
-import pandas as pd
-import ollama
+from botocore.exceptions import ClientError
 import os
+import json
+import time
+
+import ingest
+import leases
+import llm
+import metrics
+import preproc
+import prompts
+import resilience
+import s3errors
+import schema
+import scheduler
+import sharding
+import storage
 
 # AWS setup
-s3 = boto3.client('s3')
 bucket_raw = 'raw-bloodtest-upload-sk'
 bucket_proc = 'processed-bloodtest-upload-sk'
 
-# List trigger files
+# Trigger files live under this prefix
 trigger_prefix = 'to-process/'
-trigger_objects = s3.list_objects_v2(Bucket=bucket_proc, Prefix=trigger_prefix)
 
-if 'Contents' not in trigger_objects:
-    print("No trigger files found.")
-    exit()
+# What the LLM is given for each panel:
+#   normalize  raw upload normalized in-process by preproc (default)
+#   processed  preproc's normalized output, normalizing in-process if it isn't there yet
+#   raw        the raw upload as-is
+PIPELINE_INPUT = os.environ.get('PIPELINE_INPUT', 'normalize').strip().lower()
 
-for trigger in trigger_objects['Contents']:
-    trigger_key = trigger['Key']
-    if not trigger_key.endswith('.txt'):
-        continue
 
-    # Extract filename from trigger
-    original_filename = trigger_key.replace(trigger_prefix, '').replace('.txt', '')
-    local_file = f'/tmp/{original_filename}'
-    print(f"🟡 Processing trigger for: {original_filename}")
+def read_trigger(s3, trigger_key):
+    """
+    Returns the trigger body as a dict. Older triggers hold just the filename,
+    newer ones are JSON with the correlation id and submit time.
+    """
+    body = s3.get_object(Bucket=bucket_proc, Key=trigger_key)['Body'].read().decode('utf-8')
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            return payload
+    except ValueError:
+        pass
+    return {'filename': body}
+
 
+def trigger_filename(trigger_key):
+    return trigger_key.replace(trigger_prefix, '').replace('.txt', '')
+
+
+def read_processed(s3, original_filename):
+    """preproc's normalized CSV for the file as bytes, or None if it hasn't been written"""
     try:
-        # Download original file from RAW bucket
-        s3.download_file(bucket_raw, original_filename, local_file)
-        df = pd.read_csv(local_file)
+        response = s3.get_object(Bucket=preproc.output_bucket, Key=preproc.processed_key(original_filename))
+    except ClientError as e:
+        if s3errors.is_missing(e):
+            return None
+        raise
+    return storage.read_body(response)
+
+
+def load_panel(s3, original_filename, correlation_id=None, mode=None):
+    """
+    Loads one panel as a typed frame without touching local disk. See
+    PIPELINE_INPUT for the modes.
+    """
+    mode = mode or PIPELINE_INPUT
+    if mode not in ('normalize', 'processed', 'raw'):
+        raise ValueError(f"unknown PIPELINE_INPUT {mode!r} (expected normalize, processed or raw)")
+    with metrics.span('worker_download', correlation_id=correlation_id, mode=mode):
+        body = read_processed(s3, original_filename) if mode == 'processed' else None
+        if body is not None:
+            df, issues = schema.read_bloodwork_csv(body)
+        else:
+            response = s3.get_object(Bucket=bucket_raw, Key=original_filename)
+            if mode == 'raw':
+                df, issues = schema.read_bloodwork_csv(storage.read_body(response))
+            else:
+                # Same normalization the preproc lambda applies, streamed from the response
+                rows = preproc.preprocess_bloodwork_data(storage.open_body(response))
+                df, issues = schema.frame_from_rows(rows)
+    if issues:
+        print(f"⚠️ {len(issues)} malformed rows in {original_filename}:\n{schema.format_issues(issues)}")
+    return df
+
+
+def summarize_panel(df, backend, correlation_id=None):
+    """Runs the LLM over one panel and returns its summary text"""
+    messages = prompts.build_messages(df)
+    with metrics.span('llm_inference', correlation_id=correlation_id):
+        result = backend.chat(messages)
+    return result.text
 
-        # Create prompt
-        test_summary = "\n".join([
-            f"{row['test_name']}: {row['value']} {row['unit']} (Reference Range: {row['reference_range']})"
-            for _, row in df.iterrows()
-        ])
 
-        prompt = f"""You are a health assistant. Given this blood test data, do the following:
+def summary_key(original_filename):
+    return f'summaries/{original_filename}-summary.txt'
 
-        1. Summarize the test panel
-        2. Identify any abnormal values. For each test:
-        - Use the `reference_range` column for comparison
-        - If the reference range is a range (e.g., 13.0 - 17.0), check if the value is inside it.
-        - If the reference range is a bound (e.g., < 200 or > 40), compare accordingly.
-        3. For each abnormal value, suggest one evidence-based dietary change.
-        4. Clearly separate "Abnormal Results" and "Normal Results" in your response.
 
-        Here is the data:
+def trigger_exists(s3, trigger_key):
+    return ingest.object_exists(s3, bucket_proc, trigger_key)
 
-        {test_summary}
-"""  # triple quotes preserved
 
-        response = ollama.chat(
-            model='llama3',
-            messages=[{"role": "user", "content": prompt}]
-        )
+def summary_exists(s3, original_filename):
+    return ingest.object_exists(s3, bucket_proc, summary_key(original_filename))
+
+
+def process_trigger(s3, trigger_key, backend, df=None, worker_id=None):
+    """
+    Summarizes one queued file if this worker can claim it. df is the
+    already-loaded panel, if the scheduler read it. Returns True when this
+    worker produced the summary.
+    """
+    # Extract filename from trigger
+    original_filename = trigger_filename(trigger_key)
+
+    # Only the lease holder may work on a trigger
+    lease = leases.try_acquire(s3, bucket_proc, original_filename, worker_id or leases.default_worker_id())
+    if lease is None:
+        print(f"⏭️ {original_filename} is claimed by another worker")
+        metrics.inc('worker_claims_total', status='contended')
+        return False
+    metrics.inc('worker_claims_total', status='acquired')
+
+    try:
+        # Another worker may have finished it between our listing and the claim
+        if not trigger_exists(s3, trigger_key):
+            return False
+        # Uploads are content-addressed, so an existing summary already covers these bytes
+        if summary_exists(s3, original_filename):
+            print(f"♻️ {original_filename} already summarized; dropping duplicate trigger")
+            s3.delete_object(Bucket=bucket_proc, Key=trigger_key)
+            metrics.inc('worker_jobs_total', status='duplicate')
+            return False
+        return _process_claimed(s3, trigger_key, original_filename, backend, df, lease)
+    finally:
+        if lease.still_held():
+            lease.release()
+
+
+def _process_claimed(s3, trigger_key, original_filename, backend, df, lease):
+    print(f"🟡 Processing trigger for: {original_filename}")
+
+    correlation_id = None
+    if metrics.ENABLED:
+        try:
+            trigger = read_trigger(s3, trigger_key)
+            correlation_id = trigger.get('correlation_id')
+            if trigger.get('submitted_at'):
+                metrics.observe('pipeline_queue_wait_seconds', time.time() - trigger['submitted_at'])
+        except Exception as e:
+            print(f"⚠️ Could not read trigger body for {original_filename}: {e}")
+
+    try:
+        if df is None:
+            df = load_panel(s3, original_filename, correlation_id)
 
-        summary = response['message']['content']
+        # Keep the lease alive through inference; if it was lost, the job now
+        # belongs to another worker and this result must not be published
+        with leases.LeaseKeeper(lease) as keeper:
+            summary = summarize_panel(df, backend, correlation_id)
+        if keeper.lost:
+            raise RuntimeError("lease lost during inference; leaving the job to its new owner")
 
         # Upload summary
-        output_key = f'summaries/{original_filename}-summary.txt'
-        s3.put_object(Body=summary.encode('utf-8'), Bucket=bucket_proc, Key=output_key)
+        output_key = summary_key(original_filename)
+        with metrics.span('summary_upload', correlation_id=correlation_id):
+            summary_metadata = {'prompt-version': prompts.PROMPT_VERSION}
+            if correlation_id:
+                summary_metadata[metrics.CORRELATION_METADATA_KEY] = correlation_id
+            storage.put_object(s3, bucket_proc, output_key, summary, summary_metadata)
 
         print(f"✅ Summary uploaded: {output_key}")
 
@@ -70,5 +176,105 @@ for trigger in trigger_objects['Contents']:
         s3.delete_object(Bucket=bucket_proc, Key=trigger_key)
         print(f"🧹 Trigger removed: {trigger_key}\n")
 
+        metrics.inc('worker_jobs_total', status='ok')
+        return True
+
     except Exception as e:
+        metrics.inc('worker_jobs_total', status='error')
         print(f"❌ Failed to process {original_filename}: {e}\n")
+        return False
+
+
+def list_triggers(s3, shard=None, steal=True):
+    """
+    The queued trigger objects. With a sharding.Shard, only the ones it owns,
+    plus its bounded steals unless steal is False.
+    """
+    triggers = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_proc, Prefix=trigger_prefix):
+        triggers.extend(t for t in page.get('Contents', []) if t['Key'].endswith('.txt'))
+    if shard is None:
+        return triggers
+    if not steal:
+        return [t for t in triggers if shard.owns(trigger_filename(t['Key']))]
+    return shard.select(triggers, lambda t: trigger_filename(t['Key']),
+                        lambda t: t['LastModified'].timestamp())
+
+
+def trigger_severity(s3, trigger_key):
+    """The urgency score the app stored in the trigger; 0 for older triggers"""
+    try:
+        return float(read_trigger(s3, trigger_key).get('severity') or 0.0)
+    except Exception as e:
+        # Leave it to process_trigger to report a trigger that can't be read
+        print(f"⚠️ Could not read urgency of {trigger_key}: {e}")
+        return 0.0
+
+
+def run_worker(s3, backend, worker_id, shard=None):
+    """
+    One pass over the trigger queue, most urgent first. With a
+    sharding.Shard, only the triggers that shard owns are claimed. The queue
+    is listed again after every job, so a panel that arrives mid-pass
+    competes with the ones already queued. Returns the number of summaries
+    this worker wrote.
+    """
+    queue = scheduler.UrgencyQueue()
+    queued = set()
+
+    def enqueue(triggers):
+        # Scoring only reads the small trigger body; panels load when claimed
+        for trigger in triggers:
+            if trigger['Key'] not in queued:
+                queued.add(trigger['Key'])
+                queue.push(trigger['Key'], trigger_severity(s3, trigger['Key']),
+                           trigger['LastModified'].timestamp())
+
+    enqueue(list_triggers(s3, shard))
+    if shard is not None:
+        print(f"🧩 {shard}: {len(queue)} triggers")
+
+    if not queue:
+        print("No trigger files found.")
+        return 0
+
+    print(f"📋 {len(queue)} jobs queued by urgency")
+
+    completed = 0
+    while queue:
+        # With the LLM down, leave the rest queued rather than failing each job
+        if resilience.breaker('llm').is_open:
+            print(f"⚡ LLM unavailable; leaving {len(queue)} jobs for the next pass")
+            break
+        trigger_key, score, _ = queue.pop()
+        print(f"🔺 Urgency {score:.1f}: {trigger_key}")
+        if process_trigger(s3, trigger_key, backend, worker_id=worker_id):
+            completed += 1
+        # Steals were already granted for this pass
+        enqueue(list_triggers(s3, shard, steal=False))
+    return completed
+
+
+def main():
+    s3 = resilience.s3_client()
+    worker_id = leases.default_worker_id()
+
+    # Load the model once up front so the first job doesn't pay for it
+    backend = llm.get_backend()
+    try:
+        backend.warm_up()
+    except Exception as e:
+        print(f"⚠️ LLM warm-up failed ({backend.name}/{backend.model}): {e}")
+
+    membership = sharding.from_env(s3, bucket_proc, worker_id)
+    try:
+        run_worker(s3, backend, worker_id, membership.shard() if membership else None)
+    finally:
+        if membership:
+            membership.leave()
+    metrics.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Content-addressed storage for raw uploads.
+
+An upload is stored once, under objects/<sha256>.csv in the raw bucket, no
+matter who uploads it or what the file is called. The rest of the pipeline
+uses that content key as the file name: preproc output, alerts, triggers and
+summaries. Identical bytes therefore map to the same work everywhere. A small
+manifest object per uploader and filename records which hash each name
+pointed to last:
+
+    manifests/<uploader>/<filename>.json  ->  {"sha256", "key", "uploaded_at"}
+
+Each (uploader, filename) pair gets its own manifest object, so concurrent
+uploads never read-modify-write a shared file. Two users uploading
+"results.csv" now get separate manifest entries instead of overwriting
+each other's object.
+"""
+import hashlib
+import json
+import time
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+
+import s3errors
+import storage
+
+OBJECT_PREFIX = 'objects/'
+MANIFEST_PREFIX = 'manifests/'
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_key(digest):
+    return f"{OBJECT_PREFIX}{digest}.csv"
+
+
+def manifest_key(uploader, filename):
+    return f"{MANIFEST_PREFIX}{quote(uploader, safe='')}/{quote(filename, safe='')}.json"
+
+
+def object_exists(s3, bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if s3errors.is_missing(e):
+            return False
+        raise
+
+
+def store(s3, bucket, data, uploader, filename, metadata=None, manifest_bucket=None):
+    """
+    Stores data under its content key unless it is already there, then
+    records the manifest entry. Manifests go to manifest_bucket if given, so
+    they don't fire the raw bucket's upload notifications. Returns
+    (key, created). created is False when the same bytes were stored before,
+    in which case no PUT happens, so the preproc lambda is not triggered again.
+    """
+    digest = content_hash(data)
+    key = content_key(digest)
+
+    created = False
+    if not object_exists(s3, bucket, key):
+        object_metadata = dict(metadata or {})
+        object_metadata['content-sha256'] = digest
+        object_metadata['original-filename'] = quote(filename)
+        try:
+            # IfNoneMatch makes a concurrent upload of the same bytes a no-op
+            storage.put_object(s3, bucket, key, data, object_metadata, IfNoneMatch='*')
+            created = True
+        except ClientError as e:
+            if not s3errors.is_conflict(e):
+                raise
+
+    entry = {'sha256': digest, 'key': key, 'filename': filename, 'uploaded_at': time.time()}
+    s3.put_object(Bucket=manifest_bucket or bucket, Key=manifest_key(uploader, filename),
+                  Body=json.dumps(entry).encode('utf-8'), ContentType='application/json')
+    return key, created
+
@@ -1,9 +1,47 @@
-import boto3
 import pandas as pd
 from io import StringIO
 
+import resilience
+import schema
+import storage
+
+# Placeholder for missing text; numeric and date columns keep real nulls
+TEXT_MISSING = 'N/A'
+
+
+def _coerce(df, column, convert, problem, issues):
+    """Converts one column, recording each value that became NaN/NaT in issues"""
+    raw = df[column]
+    df[column] = convert(raw)
+    bad = df[column].isna() & raw.notna()
+    for index in df.index[bad]:
+        issues.append({'row': int(index) + 2, 'column': column, 'problem': f"{problem} {raw[index]!r}"})
+
+
+def clean_frame(df, issues=None):
+    """
+    Normalizes column names and types. Numeric columns stay float64 with NaN,
+    dates become datetime64 with NaT, and only text columns get TEXT_MISSING.
+    Values that don't parse (e.g. "<0.5" or "Negative") are blanked, and each
+    one is appended to issues in schema.read_bloodwork_csv's format.
+    """
+    issues = [] if issues is None else issues
+    df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
+    for column in schema.NUMERIC_COLUMNS:
+        if column in df.columns:
+            _coerce(df, column, lambda raw: pd.to_numeric(raw, errors='coerce').astype('float64'),
+                    "non-numeric value", issues)
+    for column in schema.DATE_COLUMNS:
+        if column in df.columns:
+            _coerce(df, column, lambda raw: pd.to_datetime(raw, errors='coerce'), "unparseable date", issues)
+    text_columns = [column for column in df.columns
+                    if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])]
+    df[text_columns] = df[text_columns].fillna(TEXT_MISSING)
+    return df
+
+
 def lambda_handler(event, context):
-    s3 = boto3.client('s3')
+    s3 = resilience.s3_client()
     
     # Get the uploaded file details
     source_bucket = event['Records'][0]['s3']['bucket']['name']
@@ -12,19 +50,24 @@ def lambda_handler(event, context):
 
     # Read the file from S3
     response = s3.get_object(Bucket=source_bucket, Key=object_key)
-    df = pd.read_csv(response['Body'])
+    df = pd.read_csv(storage.open_body(response))
 
     # Clean the data
-    df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
-    df['date'] = pd.to_datetime(df['date'])
-    df.fillna('N/A', inplace=True)
+    issues = []
+    df = clean_frame(df, issues)
+    if issues:
+        print(f"⚠️ {len(issues)} values in {object_key} could not be parsed and were left blank:\n"
+              f"{schema.format_issues(issues)}")
 
-    # Save cleaned data to processed bucket
+    # Save cleaned data to processed bucket. Missing numbers and dates are
+    # written as empty cells and dates as ISO strings, so schema.read_bloodwork_csv
+    # reads them back as NaN/NaT with the same dtypes.
     csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    s3.put_object(Bucket=destination_bucket, Key=object_key, Body=csv_buffer.getvalue())
+    df.to_csv(csv_buffer, index=False, na_rep='', date_format='%Y-%m-%d')
+    storage.put_object(s3, destination_bucket, object_key, csv_buffer.getvalue(),
+                       {'unparsed-values': str(len(issues))})
 
     return {
         'statusCode': 200,
-        'body': f'File cleaned and saved to {destination_bucket}'
+        'body': f'File cleaned and saved to {destination_bucket} ({len(issues)} unparsed values blanked)'
     }
@@ -0,0 +1,154 @@
+"""
+Lease-based job claiming so several ec2.py workers can share one trigger queue.
+
+Before a worker processes to-process/<file>.txt it must hold the lease object
+in-progress/<file>.lease. The lease records the holder and an expiry time. All
+lease writes are S3 conditional PUTs:
+- acquire: IfNoneMatch='*', which succeeds for exactly one worker
+- take over an expired lease: IfMatch on the ETag that was read
+- renew: IfMatch on the ETag from the holder's own last write
+A worker that loses any of these races gets a 412 and backs off, so at most
+one worker holds a given lease at a time. A LeaseKeeper thread renews the
+lease while inference runs. A crashed worker's lease expires and the next
+worker to list the trigger reclaims it.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+import s3errors
+
+LEASE_PREFIX = 'in-progress/'
+LEASE_SECONDS = float(os.environ.get('LEASE_SECONDS', '300'))
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def lease_key(job_name):
+    return f"{LEASE_PREFIX}{job_name}.lease"
+
+
+class Lease:
+    def __init__(self, s3, bucket, key, worker_id, etag, expires_at, duration):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.worker_id = worker_id
+        self.etag = etag
+        self.expires_at = expires_at
+        self.duration = duration
+
+    def _body(self, expires_at):
+        return json.dumps({'worker_id': self.worker_id, 'expires_at': expires_at}).encode('utf-8')
+
+    def renew(self):
+        """Extends the lease. Returns False if another worker has taken it over."""
+        expires_at = time.time() + self.duration
+        try:
+            response = self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=self._body(expires_at),
+                                          IfMatch=self.etag)
+        except ClientError as e:
+            if s3errors.is_conflict(e) or s3errors.is_missing(e):
+                # Taken over; make sure we never release the new owner's lease
+                self.expires_at = 0
+                return False
+            raise
+        self.etag = response['ETag']
+        self.expires_at = expires_at
+        return True
+
+    def still_held(self):
+        """True until the lease expires or a renewal finds it taken over"""
+        return time.time() < self.expires_at
+
+    def release(self):
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if not s3errors.is_missing(e):
+                raise
+
+
+def try_acquire(s3, bucket, job_name, worker_id, duration=LEASE_SECONDS):
+    """Claims the job's lease, taking over an expired one. Returns a Lease or None."""
+    key = lease_key(job_name)
+    expires_at = time.time() + duration
+    body = json.dumps({'worker_id': worker_id, 'expires_at': expires_at}).encode('utf-8')
+
+    try:
+        response = s3.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch='*')
+        return Lease(s3, bucket, key, worker_id, response['ETag'], expires_at, duration)
+    except ClientError as e:
+        if not s3errors.is_conflict(e):
+            raise
+
+    # Someone holds (or held) it; take over only if that lease has expired
+    try:
+        current = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if s3errors.is_missing(e):
+            # Released between our two calls; leave it for the next pass
+            return None
+        raise
+    try:
+        holder = json.loads(current['Body'].read())
+        expired = float(holder.get('expires_at', 0)) < time.time()
+    except (ValueError, TypeError):
+        expired = True
+    if not expired:
+        return None
+
+    try:
+        response = s3.put_object(Bucket=bucket, Key=key, Body=body, IfMatch=current['ETag'])
+    except ClientError as e:
+        if s3errors.is_conflict(e) or s3errors.is_missing(e):
+            return None
+        raise
+    return Lease(s3, bucket, key, worker_id, response['ETag'], expires_at, duration)
+
+
+class LeaseKeeper:
+    """
+    Renews a lease in the background while a job runs:
+
+        with LeaseKeeper(lease) as keeper:
+            ... long inference ...
+            if keeper.lost: abandon the result
+    """
+
+    def __init__(self, lease, interval=None):
+        self.lease = lease
+        self.interval = interval if interval is not None else lease.duration / 3
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.lease.renew():
+                    self.lost = True
+                    return
+            except Exception:
+                # Transient error: keep trying until the lease actually runs out
+                if not self.lease.still_held():
+                    self.lost = True
+                    return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.lease.still_held():
+            self.lost = True
+        return False
@@ -0,0 +1,159 @@
+"""
+Inference backends for the summarization worker.
+
+ec2.py talks to an LLMBackend rather than calling ollama directly. The backend
+owns the model name, the per-call timeout, keep-alive pinning and startup
+warm-up, and it records per-call latency and token counts via metrics.
+
+Configured from the environment:
+    LLM_BACKEND     ollama (default) or stub
+    LLM_MODEL       model name, default llama3
+    LLM_TIMEOUT     per-call timeout in seconds, default 300
+    LLM_KEEP_ALIVE  how long ollama keeps the model loaded after a call, default 30m
+                    (-1 pins it in memory indefinitely)
+    OLLAMA_HOST     ollama server URL, default http://localhost:11434
+    LLM_STUB_LATENCY  simulated seconds per call for the stub, default 0
+"""
+import hashlib
+import os
+import time
+
+import metrics
+import resilience
+
+DEFAULT_MODEL = 'llama3'
+DEFAULT_TIMEOUT = 300.0
+DEFAULT_KEEP_ALIVE = '30m'
+
+
+class LLMResult:
+    __slots__ = ('text', 'prompt_tokens', 'completion_tokens', 'seconds', 'prompt_eval_seconds')
+
+    def __init__(self, text, prompt_tokens=None, completion_tokens=None, seconds=None,
+                 prompt_eval_seconds=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.seconds = seconds
+        self.prompt_eval_seconds = prompt_eval_seconds
+
+
+class LLMBackend:
+    name = 'base'
+
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = model
+
+    def warm_up(self):
+        """Load the model ahead of the first job. No-op by default."""
+
+    def _chat(self, messages):
+        raise NotImplementedError
+
+    def chat(self, messages):
+        """Runs one chat completion and records its latency and token metrics"""
+        started = time.perf_counter()
+        try:
+            result = resilience.call('llm', self._chat, messages)
+        except Exception:
+            metrics.inc('llm_calls_total', backend=self.name, status='error')
+            raise
+        result.seconds = time.perf_counter() - started
+        metrics.inc('llm_calls_total', backend=self.name, status='ok')
+        metrics.observe('llm_call_seconds', result.seconds, backend=self.name)
+        if result.prompt_eval_seconds is not None:
+            metrics.observe('llm_prompt_eval_seconds', result.prompt_eval_seconds, backend=self.name)
+        if result.prompt_tokens:
+            metrics.inc('llm_prompt_tokens_total', result.prompt_tokens, backend=self.name)
+        if result.completion_tokens:
+            metrics.inc('llm_completion_tokens_total', result.completion_tokens, backend=self.name)
+        return result
+
+
+def _field(response, name):
+    """Reads a field from an ollama response (dict in older clients, model object in newer)"""
+    try:
+        return response[name]
+    except (KeyError, TypeError):
+        return getattr(response, name, None)
+
+
+class OllamaBackend(LLMBackend):
+    name = 'ollama'
+
+    def __init__(self, model=DEFAULT_MODEL, host=None, timeout=DEFAULT_TIMEOUT,
+                 keep_alive=DEFAULT_KEEP_ALIVE, options=None):
+        super().__init__(model)
+        import ollama
+        # The timeout is enforced by the HTTP client, so a hung server fails
+        # this call instead of stalling the whole worker loop
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.keep_alive = keep_alive
+        self.options = options
+
+    def warm_up(self):
+        # An empty generate request loads the model and applies keep_alive
+        started = time.perf_counter()
+        self.client.generate(model=self.model, prompt='', keep_alive=self.keep_alive)
+        metrics.observe('llm_warm_up_seconds', time.perf_counter() - started, backend=self.name)
+
+    def _chat(self, messages):
+        response = self.client.chat(model=self.model, messages=messages,
+                                    keep_alive=self.keep_alive, options=self.options)
+        prompt_eval_ns = _field(response, 'prompt_eval_duration')
+        return LLMResult(
+            text=_field(response, 'message')['content'],
+            prompt_tokens=_field(response, 'prompt_eval_count'),
+            completion_tokens=_field(response, 'eval_count'),
+            prompt_eval_seconds=prompt_eval_ns / 1e9 if prompt_eval_ns else None,
+        )
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic in-process backend for tests and benchmarks. The same prompt
+    always produces the same summary, and latency can be simulated.
+    """
+    name = 'stub'
+
+    def __init__(self, model='stub', latency=0.0):
+        super().__init__(model)
+        self.latency = latency
+        self.calls = 0
+
+    def _chat(self, messages):
+        self.calls += 1
+        prompt = '\n'.join(m['content'] for m in messages)
+        if self.latency:
+            time.sleep(self.latency)
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        user_text = '\n'.join(m['content'] for m in messages if m['role'] == 'user')
+        data_lines = [line.strip() for line in user_text.splitlines() if 'Reference Range: ' in line
+                      and not line.startswith('Each line')]
+        text = (f"Summary ({len(data_lines)} tests, stub {digest})\n\n"
+                "Abnormal Results\n- none assessed (stub backend)\n\n"
+                "Normal Results\n" + '\n'.join(f"- {line}" for line in data_lines))
+        return LLMResult(
+            text=text,
+            prompt_tokens=len(prompt.split()),
+            completion_tokens=len(text.split()),
+        )
+
+
+def get_backend():
+    """Builds the backend selected by the LLM_* environment variables"""
+    kind = os.environ.get('LLM_BACKEND', 'ollama').strip().lower()
+    if kind == 'stub':
+        return StubBackend(latency=float(os.environ.get('LLM_STUB_LATENCY', '0')))
+    if kind != 'ollama':
+        raise ValueError(f"unknown LLM_BACKEND {kind!r} (expected 'ollama' or 'stub')")
+    keep_alive = os.environ.get('LLM_KEEP_ALIVE', DEFAULT_KEEP_ALIVE)
+    # ollama takes an integer number of seconds or a duration string
+    if keep_alive.lstrip('-').isdigit():
+        keep_alive = int(keep_alive)
+    return OllamaBackend(
+        model=os.environ.get('LLM_MODEL', DEFAULT_MODEL),
+        host=os.environ.get('OLLAMA_HOST'),
+        timeout=float(os.environ.get('LLM_TIMEOUT', DEFAULT_TIMEOUT)),
+        keep_alive=keep_alive,
+    )
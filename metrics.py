@@ -0,0 +1,197 @@
+"""
+Lightweight tracing and metrics shared by app.py, preproc.py and ec2.py.
+
+Every upload gets a correlation id that rides along in S3 object metadata and
+in the trigger body, so one request can be followed from the Streamlit upload
+through the Lambda and the worker to the summary read-back. Stages are timed
+with span(); counters and histograms are kept in-process and exported either
+as Prometheus text or as one JSON log line per span.
+
+Each process calls flush() at the end of a unit of work (an app rerun, a
+Lambda invocation, a worker pass). In Prometheus mode it rewrites
+PIPELINE_METRICS_FILE, so give each process its own file. In JSON mode it logs
+one "metrics" line with the process's cumulative counters and histograms.
+
+Disabled by default. Set PIPELINE_METRICS=prometheus or PIPELINE_METRICS=json
+to turn it on. When disabled, span() returns a shared no-op context manager
+and inc()/observe() return immediately.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+MODE = os.environ.get('PIPELINE_METRICS', '').strip().lower()
+ENABLED = MODE not in ('', '0', 'false', 'off')
+
+# Seconds; tuned for stages ranging from S3 calls to multi-minute LLM inference
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# S3 user-metadata key carrying the correlation id (sent as x-amz-meta-correlation-id)
+CORRELATION_METADATA_KEY = 'correlation-id'
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                hist['buckets'][i] += 1
+                break
+        hist['sum'] += value
+        hist['count'] += 1
+
+
+def log_event(event, **fields):
+    """Emit one structured JSON log line (JSON mode only)"""
+    if MODE != 'json':
+        return
+    fields.update(event=event, ts=time.time())
+    print(json.dumps(fields, default=str), file=sys.stdout, flush=True)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextmanager
+def _timed_span(stage, correlation_id, labels):
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('pipeline_stage_seconds', elapsed, stage=stage)
+        inc('pipeline_stage_total', stage=stage, status=status)
+        log_event('span', stage=stage, status=status, seconds=round(elapsed, 6),
+                  correlation_id=correlation_id, **labels)
+
+
+def span(stage, correlation_id=None, **labels):
+    """
+    Time one pipeline stage:
+
+        with metrics.span('s3_upload', correlation_id=cid):
+            ...
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return _timed_span(stage, correlation_id, labels)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus():
+    """Current counters and histograms in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                      for k, v in _histograms.items()}
+
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), hist in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, hist['buckets']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=None):
+    """
+    Atomically write the exposition text to a file, for node_exporter's
+    textfile collector. Defaults to $PIPELINE_METRICS_FILE.
+    """
+    path = path or os.environ.get('PIPELINE_METRICS_FILE')
+    if not ENABLED or not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def snapshot():
+    """Current counters and histograms as JSON-friendly lists"""
+    with _lock:
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = [{'name': name, 'labels': dict(labels), 'le': list(DEFAULT_BUCKETS),
+                       'buckets': list(hist['buckets']), 'sum': hist['sum'], 'count': hist['count']}
+                      for (name, labels), hist in sorted(_histograms.items())]
+    return {'counters': counters, 'histograms': histograms}
+
+
+def flush():
+    """Exports counters and histograms for the configured mode; see the module docstring"""
+    if not ENABLED:
+        return
+    if MODE == 'json':
+        log_event('metrics', **snapshot())
+    else:
+        write_prometheus()
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -1,8 +1,17 @@
-import boto3
 import csv
 import json
+import math
 import os
 import io
+import re
+from array import array
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+
+import alerts
+import metrics
+import resilience
+import storage
 
 # Standardize test names and units
 test_name_mapping = {
@@ -15,6 +24,12 @@ test_name_mapping = {
    'HEMOGLOBIN': 'Hemoglobin',
    'HEMOGLOBIN (HGB)': 'Hemoglobin',
    'HGB': 'Hemoglobin',
+   'HEMATOCRIT': 'Hematocrit',
+   'HEMATOCRIT (HCT)': 'Hematocrit',
+   'HCT': 'Hematocrit',
+   'PLATELET COUNT': 'Platelets',
+   'PLATELET COUNT (PLT)': 'Platelets',
+   'PLT': 'Platelets',
    'GLUCOSE': 'Glucose',
    'CALCIUM': 'Calcium',
    'SODIUM': 'Sodium',
@@ -39,9 +54,12 @@ target_units = {
    'WBC': '10^3/uL',
    'RBC': '10^6/uL',
    'Hemoglobin': 'g/dL',
+   'Hematocrit': '%',
+   'Platelets': '10^3/uL',
    'Glucose': 'mg/dL',
    'Calcium': 'mg/dL',
    'Sodium': 'mmol/L',
+   'Potassium': 'mmol/L',
    'Total Cholesterol': 'mg/dL',
    'LDL Cholesterol': 'mg/dL',
    'HDL Cholesterol': 'mg/dL',
@@ -49,18 +67,197 @@ target_units = {
    'Free T4': 'ng/dL'
 }
 
-def convert_value(value, from_unit, to_unit, test):
+# Words that don't change which test a name refers to
+_NAME_STOPWORDS = {'COUNT', 'LEVEL', 'SERUM', 'PLASMA', 'TEST'}
+
+# Minimum trigram similarity for a misspelled word to count as a known one.
+# Applied per word, so an extra word like "A1C" never matches "HEMOGLOBIN".
+_TOKEN_SIMILARITY = 0.7
+
+
+def _normalize_name(name):
+   """Uppercase, punctuation-insensitive key: 'Hgb.' -> 'HGB', 'T4, Free' -> 'T4 FREE'"""
+   return ' '.join(re.sub(r'[^A-Z0-9^]+', ' ', name.upper()).split())
+
+
+def _tokens(normalized):
+   """Words of a normalized name with plurals folded and filler words dropped"""
+   tokens = []
+   for token in normalized.split():
+       if token in _NAME_STOPWORDS:
+           continue
+       if len(token) > 3 and token.endswith('S'):
+           token = token[:-1]
+       tokens.append(token)
+   return tokens
+
+
+def _trigrams(text):
+   padded = f"  {text} "
+   return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _split_parenthetical(name):
+   """'Hematocrit (HCT)' -> ['Hematocrit', 'HCT']"""
+   match = re.match(r'^(.*?)\s*\(([^)]*)\)\s*$', name)
+   if match:
+       return [part for part in match.groups() if part.strip()]
+   return []
+
+
+# Single-word names up to this length count as abbreviations ('HGB', 'FT4')
+_ABBREVIATION_MAX_LENGTH = 5
+
+
+def _build_name_index():
+   """
+   Precomputes the lookup tables behind resolve_test_name from
+   test_name_mapping and the canonical names themselves.
+   """
+   exact, by_tokens, abbreviations, trigram_postings = {}, {}, {}, {}
+   sources = list(test_name_mapping.items()) + [(name, name) for name in set(test_name_mapping.values())]
+   for raw, canonical in sources:
+       # Parenthetical aliases: 'WHITE BLOOD CELL COUNT (WBC)' also indexes 'WBC'
+       for variant in [raw] + _split_parenthetical(raw):
+           key = _normalize_name(variant)
+           exact.setdefault(key, canonical)
+           by_tokens.setdefault(frozenset(_tokens(key)), canonical)
+           if ' ' not in key and len(key) <= _ABBREVIATION_MAX_LENGTH:
+               abbreviations.setdefault(key, canonical)
+
+   # Trigram postings over the known words, for correcting misspellings
+   vocabulary = set().union(*by_tokens)
+   for token in vocabulary:
+       for gram in _trigrams(token):
+           trigram_postings.setdefault(gram, set()).add(token)
+   return exact, by_tokens, abbreviations, vocabulary, trigram_postings
+
+
+_name_exact, _name_tokens, _name_abbreviations, _name_vocabulary, _name_trigrams = _build_name_index()
+
+
+def _closest_token(token):
+   """Best known word for a misspelled one, or None"""
+   if len(token) < 4:
+       return None
+   grams = _trigrams(token)
+   shared = {}
+   for gram in grams:
+       for candidate in _name_trigrams.get(gram, ()):
+           shared[candidate] = shared.get(candidate, 0) + 1
+   best, best_score = None, 0.0
+   for candidate, overlap in shared.items():
+       score = 2.0 * overlap / (len(grams) + len(_trigrams(candidate)))
+       if score > best_score:
+           best, best_score = candidate, score
+   return best if best_score >= _TOKEN_SIMILARITY else None
+
+
+def _match_name(normalized, fuzzy=False):
+   canonical = _name_exact.get(normalized)
+   if canonical is not None:
+       return canonical
+   tokens = _tokens(normalized)
+   if fuzzy:
+       tokens = [t if t in _name_vocabulary else _closest_token(t) for t in tokens]
+       if None in tokens:
+           return None
+   return _name_tokens.get(frozenset(tokens))
+
+
+@lru_cache(maxsize=4096)
+def resolve_test_name(name):
+   """
+   Maps a raw test name that missed the exact lookup to its canonical name,
+   or None if nothing matches. Tries punctuation-insensitive and word-set
+   keys, then per-word trigram spelling correction, then parenthetical parts.
+   Results are memoized so each distinct spelling is resolved only once.
+   """
+   normalized = _normalize_name(name)
+   if not normalized:
+       return None
+
+   canonical = _resolve(normalized)
+   if canonical is not None:
+       return canonical
+   return _resolve_parenthetical(name)
+
+
+def _resolve(normalized):
+   for fuzzy in (False, True):
+       canonical = _match_name(normalized, fuzzy)
+       if canonical is not None:
+           return canonical
+   return None
+
+
+def _resolve_parenthetical(name):
+   """
+   'Outer (inner)' resolves only when the parts agree. Either both name the
+   same test, or the inner part is a known abbreviation that the outer part
+   doesn't contradict, or the inner part is only filler like '(serum)'. A
+   qualifier such as '(ionized)' or '(urine)' names a different test and
+   never matches.
+   """
+   parts = _split_parenthetical(name)
+   if len(parts) != 2:
+       return None
+   outer, inner = (_normalize_name(part) for part in parts)
+   outer_match = _resolve(outer) if outer else None
+   if inner in _name_abbreviations:
+       abbreviation = _name_abbreviations[inner]
+       return abbreviation if outer_match in (None, abbreviation) else None
+   if not _tokens(inner):
+       return outer_match
+   inner_match = _resolve(inner)
+   return outer_match if outer_match is not None and inner_match == outer_match else None
+
+
+# Cell-count units as a power of ten per uL. Labs write thousands per uL as
+# 10^3/uL, x10E3/uL, 10*3/uL, K/uL or thou/uL; 10^9/L is the same amount.
+_COUNT_PREFIXES = {'': 0, 'cells': 0, 'k': 3, 'thou': 3, 'thousand': 3, 'm': 6, 'mil': 6, 'million': 6}
+_COUNT_POWER = re.compile(r'^x?10[\^*e](\d+)$')
+_COUNT_VOLUMES = (('/ul', 0), ('/mm3', 0), ('/l', -6))
+
+def _count_exponent(unit):
+   """Power of ten per uL that a cell-count unit stands for, or None if it isn't one"""
+   unit = unit.strip().lower().replace('μ', 'u').replace('µ', 'u').replace(' ', '')
+   for volume, offset in _COUNT_VOLUMES:
+      if unit.endswith(volume):
+         prefix = unit[:-len(volume)]
+         break
+   else:
+      return None
+   if prefix in _COUNT_PREFIXES:
+      return _COUNT_PREFIXES[prefix] + offset
+   match = _COUNT_POWER.match(prefix)
+   return int(match.group(1)) + offset if match else None
+
+def convert_value(value, from_unit, to_unit, test, strict=False):
+   """
+   Converts value from from_unit to to_unit for test. When no rule covers
+   the pair, the value is returned unchanged, or None if strict is set.
+   """
    value = float(value)
    
-   # Convert WBC count
-   if test == 'WBC':
-       if 'x10^9/L' in from_unit or '10^9/L' in from_unit:
-           return value  # Equivalent to 10^3/uL
+   # Convert cell counts (WBC, RBC, Platelets) between spellings and scales
+   if test in ('WBC', 'RBC', 'Platelets'):
+       have, want = _count_exponent(from_unit), _count_exponent(to_unit)
+       if have is not None and want is not None:
+           shift = have - want
+           return value * 10 ** shift if shift >= 0 else value / 10 ** -shift
+   
+   # Convert Hematocrit
+   if test == 'Hematocrit' and 'L/L' in from_unit and '%' in to_unit:
+       return value * 100.0
+   
+   # Convert Potassium
+   if test == 'Potassium' and 'mEq/L' in from_unit:
+       return value  # Equivalent to mmol/L for a monovalent ion
    
-   # Convert RBC count
-   if test == 'RBC':
-       if 'x10^12/L' in from_unit or '10^12/L' in from_unit:
-           return value  # Equivalent to 10^6/uL
+   # Convert TSH
+   if test == 'TSH' and 'uIU/mL' in from_unit:
+       return value  # Equivalent to mIU/L
    
    # Convert Glucose
    if test == 'Glucose' and 'mmol/L' in from_unit and 'mg/dL' in to_unit:
@@ -75,44 +272,197 @@ def convert_value(value, from_unit, to_unit, test):
        return value / 12.87
    
    # If no specific conversion needed, return original
-   return value
+   return None if strict else value
 
-def preprocess_bloodwork_data(file_obj):
+# Where the normalized output lands; ec2.py can read it from here
+output_bucket = 'processed-bloodtest-data-sk'
+
+def processed_key(file_key):
+   return f"processed/{os.path.basename(file_key)}"
+
+class NormalizedRow(Mapping):
+   """
+   Dict-compatible view of one row of a NormalizedRows table. Reads, .get,
+   .keys and dict(row) work as on a plain dict; assigning a key writes
+   through to the table.
+   """
+   __slots__ = ('_table', '_index')
+
+   def __init__(self, table, index):
+      self._table = table
+      self._index = index
+
+   def __getitem__(self, key):
+      return self._table.get_value(self._index, key)
+
+   def __setitem__(self, key, value):
+      self._table.set_value(self._index, key, value)
+
+   def __iter__(self):
+      return iter(self._table.fieldnames)
+
+   def __len__(self):
+      return len(self._table.fieldnames)
+
+   def __repr__(self):
+      return repr(dict(self))
+
+
+class NormalizedRows(Sequence):
+   """
+   Column-oriented rows returned by preprocess_bloodwork_data.
+
+   Values are kept in an array('d'), with NaN where a value is missing.
+   Every other column is dictionary-encoded: an array('I') of codes plus
+   the list of distinct strings, so a test name or unit repeated on every
+   row is stored once per table. Indexing gives a NormalizedRow view, so
+   callers written for a list of dicts keep working. column() and
+   iter_rows() read whole columns without building per-row objects.
+   """
+
+   def __init__(self, fieldnames):
+      self.fieldnames = list(fieldnames)
+      self._has_value = 'value' in self.fieldnames
+      self._values = array('d')
+      self._codes = {name: array('I') for name in self.fieldnames if name != 'value'}
+      self._strings = {name: [] for name in self._codes}
+      self._lookup = {name: {} for name in self._codes}
+
+   def __len__(self):
+      return len(self._values)
+
+   def __iter__(self):
+      return (NormalizedRow(self, i) for i in range(len(self)))
+
+   def __getitem__(self, index):
+      if isinstance(index, slice):
+         return [NormalizedRow(self, i) for i in range(*index.indices(len(self)))]
+      if index < 0:
+         index += len(self)
+      if not 0 <= index < len(self):
+         raise IndexError('row index out of range')
+      return NormalizedRow(self, index)
+
+   def _encode(self, name, text):
+      lookup = self._lookup[name]
+      code = lookup.get(text)
+      if code is None:
+         code = lookup[text] = len(self._strings[name])
+         self._strings[name].append(text)
+      return code
+
+   def append(self, fields, value):
+      """fields maps column name to text; value is a float or None"""
+      for name, codes in self._codes.items():
+         text = fields.get(name)
+         code = self._lookup[name].get(text)
+         codes.append(self._encode(name, text) if code is None else code)
+      self._values.append(math.nan if value is None else value)
+
+   def add_column(self, name, text=None):
+      """Adds a column, set to text on every row"""
+      if name == 'value' or name in self._codes:
+         raise ValueError(f"column {name!r} already exists")
+      self.fieldnames.append(name)
+      self._codes[name] = array('I')
+      self._strings[name] = []
+      self._lookup[name] = {}
+      self._codes[name].extend([self._encode(name, text)] * len(self))
+
+   def get_value(self, index, name):
+      if name == 'value' and self._has_value:
+         value = self._values[index]
+         return None if math.isnan(value) else value
+      if name not in self._codes:
+         raise KeyError(name)
+      return self._strings[name][self._codes[name][index]]
+
+   def set_value(self, index, name, value):
+      if name == 'value' and self._has_value:
+         self._values[index] = math.nan if value is None else float(value)
+         return
+      if name not in self._codes:
+         self.add_column(name)
+      self._codes[name][index] = self._encode(name, value)
+
+   def column(self, name):
+      """All values of one column as a list, None where missing"""
+      if name == 'value' and self._has_value:
+         return [None if math.isnan(value) else value for value in self._values]
+      if name not in self._codes:
+         raise KeyError(name)
+      strings = self._strings[name]
+      return [strings[code] for code in self._codes[name]]
+
+   def iter_rows(self, fieldnames=None, restval=''):
+      """Row tuples in fieldnames order (default: all columns); columns the table lacks get restval"""
+      names = self.fieldnames if fieldnames is None else fieldnames
+      columns = [self.column(name) if name in self.fieldnames else [restval] * len(self) for name in names]
+      return zip(*columns)
+
+   def write_csv(self, output, fieldnames=None, restval=''):
+      """Writes a header and every row to a text file object with csv.writer"""
+      names = self.fieldnames if fieldnames is None else fieldnames
+      writer = csv.writer(output)
+      writer.writerow(names)
+      writer.writerows(self.iter_rows(names, restval))
+
+
+def _normalize_row(fields):
+   """Canonical test name, unit and rounded value for one parsed CSV row; updates fields in place"""
+   raw_name = fields['test_name']
+   test = raw_name.strip().upper()
+   if test in test_name_mapping:
+      test = test_name_mapping[test]
+   else:
+      canonical = resolve_test_name(raw_name)
+      test = canonical if canonical is not None else raw_name
+   fields['test_name'] = test
+
+   value = fields['value']
+   if test in target_units:
+      current_unit = fields['unit'].strip()
+      target_unit = target_units[test]
+      if current_unit != target_unit:
+         converted = convert_value(value, current_unit, target_unit, test, strict=True)
+         # Without a known rule the value stays in the unit it was uploaded in
+         if converted is not None:
+            value = converted
+            fields['unit'] = target_unit
+
+   # Ensure values are numeric and properly rounded
+   try:
+      return round(float(value), 2)
+   except (ValueError, TypeError):
+      return None
+
+
+def preprocess_bloodwork_data(file_obj, on_critical=None):
    """
    Processes the uploaded bloodwork data, standardizes test names and units
-   without using pandas.
+   without using pandas. Returns a NormalizedRows table. If on_critical is
+   given, it is called with an alert dict for each row past a critical limit
+   as soon as that row is normalized.
    """
    # Read CSV file using csv module
    csv_data = file_obj.read().decode('utf-8')
-   csv_reader = csv.DictReader(io.StringIO(csv_data))
-   
-   # Convert to list of dictionaries
-   rows = list(csv_reader)
-   
-   # Standardize test names and units
-   for row in rows:
-       test = row['test_name'].strip().upper()
-       if test in test_name_mapping:
-           row['test_name'] = test_name_mapping[test]
-   
-   # Standardize units and convert values if needed
-   for row in rows:
-       test = row['test_name']
-       if test in target_units:
-           current_unit = row['unit'].strip()
-           target_unit = target_units[test]
-           
-           if current_unit != target_unit:
-               row['value'] = convert_value(row['value'], current_unit, target_unit, test)
-               row['unit'] = target_unit
-   
-   # Ensure values are numeric and properly rounded
-   for row in rows:
-       try:
-           row['value'] = round(float(row['value']), 2)
-       except (ValueError, TypeError):
-           row['value'] = None
-   
+   csv_reader = csv.reader(io.StringIO(csv_data))
+   fieldnames = next(csv_reader, [])
+   rows = NormalizedRows(fieldnames)
+
+   for record in csv_reader:
+      if not record:
+         continue
+      # Short rows read as None, like csv.DictReader
+      fields = dict(zip(fieldnames, record))
+      if len(record) < len(fieldnames):
+         fields.update((name, None) for name in fieldnames[len(record):])
+      rows.append(fields, _normalize_row(fields))
+      if on_critical is not None:
+         alert = alerts.check_row(rows[-1])
+         if alert is not None:
+            on_critical(alert)
+
    return rows
 
 def lambda_handler(event, context):
@@ -120,8 +470,14 @@ def lambda_handler(event, context):
    Lambda function handler that is triggered when a file is uploaded to S3.
    Processes the uploaded file and stores the cleaned data in another S3 bucket.
    """
+   try:
+       return _handle_upload(event)
+   finally:
+       metrics.flush()
+
+def _handle_upload(event):
    # Initialize S3 client
-   s3 = boto3.client('s3')
+   s3 = resilience.s3_client()
    
    # Get the uploaded file's details from the event
    bucket_name = event['Records'][0]['s3']['bucket']['name']
@@ -129,24 +485,34 @@ def lambda_handler(event, context):
    
    # Get the file object from S3
    response = s3.get_object(Bucket=bucket_name, Key=file_key)
-   file_obj = response['Body']
+   file_obj = storage.open_body(response)
+   
+   # Correlation id set by the uploader, if any
+   object_metadata = response.get('Metadata', {})
+   correlation_id = object_metadata.get(metrics.CORRELATION_METADATA_KEY)
    
    # Process the file
-   processed_rows = preprocess_bloodwork_data(file_obj)
+   critical_hits = []
+   with metrics.span('lambda_preprocess', correlation_id=correlation_id, key=file_key):
+       processed_rows = preprocess_bloodwork_data(file_obj, on_critical=critical_hits.append)
+   metrics.inc('preprocess_rows_total', len(processed_rows))
+   
+   # Critical values go out first, ahead of the normalized file and the LLM summary
+   with metrics.span('lambda_alert_publish', correlation_id=correlation_id, key=file_key):
+       alerts.publish(s3, file_key, critical_hits, correlation_id)
+   metrics.inc('critical_alerts_total', len(critical_hits))
    
    # Save the cleaned file to a new bucket
-   output_bucket = 'processed-bloodtest-data-sk'  # Your destination bucket
-   output_key = f"processed/{os.path.basename(file_key)}"  # New file name
+   output_key = processed_key(file_key)
    
-   # Convert the data back to CSV
+   # Convert the data back to CSV, column by column
    output = io.StringIO()
    if processed_rows:
-       writer = csv.DictWriter(output, fieldnames=processed_rows[0].keys())
-       writer.writeheader()
-       writer.writerows(processed_rows)
+       processed_rows.write_csv(output)
    
    # Upload to S3
-   s3.put_object(Bucket=output_bucket, Key=output_key, Body=output.getvalue())
+   with metrics.span('lambda_output_upload', correlation_id=correlation_id, key=output_key):
+       storage.put_object(s3, output_bucket, output_key, output.getvalue(), object_metadata)
    
    return {
        'statusCode': 200,
@@ -0,0 +1,175 @@
+"""
+Opt-in profiling for Streamlit reruns of app.py.
+
+Turn it on per session with the query parameter ?profile=1, or for every session
+with PROFILE_RERUNS = true in secrets. main() calls checkpoint() after each
+section and chart builders are wrapped with @timed. At the end of the rerun,
+finish() shows the breakdown in a sidebar panel. A rerun cut short by
+st.stop(), st.rerun() or an exception only gets stop(), which turns the
+profiler off without rendering.
+
+A full profile can also be written to disk: add ?profile_dump=1 or set
+PROFILE_DIR in secrets. The default engine is cProfile (.prof files). Use
+?profile=pyinstrument for pyinstrument HTML reports when it is installed.
+"""
+import cProfile
+import functools
+import os
+import threading
+import time
+
+import streamlit as st
+
+HISTORY_LENGTH = 20
+
+# Streamlit runs each session's script on its own thread
+_local = threading.local()
+
+
+def _secret(name, default=None):
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        # No secrets.toml configured
+        return default
+
+
+def _truthy(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on', 'pyinstrument')
+
+
+class RerunProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.enabled = False
+        self.sections = []
+        self.calls = {}
+        self._profiler = None
+        self._engine = None
+        self._dump_dir = None
+        self._running = False
+
+    def activate(self):
+        """Decide from the query string and secrets whether this rerun is profiled"""
+        requested = st.query_params.get('profile', '')
+        self.enabled = _truthy(requested) or _truthy(_secret('PROFILE_RERUNS', False))
+        if not self.enabled:
+            return self
+
+        self._dump_dir = _secret('PROFILE_DIR')
+        if self._dump_dir is None and _truthy(st.query_params.get('profile_dump', '')):
+            self._dump_dir = 'profiles'
+
+        if self._dump_dir:
+            self._engine = 'cprofile'
+            if requested == 'pyinstrument':
+                try:
+                    from pyinstrument import Profiler
+                    self._profiler = Profiler()
+                    self._engine = 'pyinstrument'
+                except ImportError:
+                    pass
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            if self._engine == 'pyinstrument':
+                self._profiler.start()
+            else:
+                self._profiler.enable()
+            self._running = True
+
+        _local.profiler = self
+        return self
+
+    def checkpoint(self, name):
+        """Record the time since the previous checkpoint as one section"""
+        now = time.perf_counter()
+        if self.enabled:
+            self.sections.append((name, now - self.last))
+        self.last = now
+
+    def record_call(self, name, elapsed):
+        count, total = self.calls.get(name, (0, 0.0))
+        self.calls[name] = (count + 1, total + elapsed)
+
+    def stop(self):
+        """Stop the profiler without rendering anything; safe to call more than once"""
+        if getattr(_local, 'profiler', None) is self:
+            _local.profiler = None
+        if not self._running:
+            return
+        self._running = False
+        if self._engine == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def finish(self):
+        """Stop profiling and render the per-rerun breakdown in the sidebar"""
+        self.stop()
+        if not self.enabled:
+            return
+
+        total = time.perf_counter() - self.started
+        dump_path = self._dump()
+
+        history = st.session_state.setdefault('_profile_history', [])
+        history.append(round(total * 1000, 1))
+        del history[:-HISTORY_LENGTH]
+
+        with st.sidebar.expander("⏱️ Rerun profile", expanded=True):
+            st.markdown(f"**Total:** {total * 1000:.1f} ms")
+            st.dataframe(
+                [{'section': name, 'ms': round(elapsed * 1000, 2), '%': round(100 * elapsed / total, 1)}
+                 for name, elapsed in sorted(self.sections, key=lambda s: -s[1])],
+                use_container_width=True
+            )
+            if self.calls:
+                st.markdown("**Chart builders**")
+                st.dataframe(
+                    [{'function': name, 'calls': count, 'ms': round(elapsed * 1000, 2)}
+                     for name, (count, elapsed) in sorted(self.calls.items(), key=lambda c: -c[1][1])],
+                    use_container_width=True
+                )
+            if len(history) > 1:
+                st.caption("Recent reruns (ms)")
+                st.line_chart(history)
+            if dump_path:
+                st.caption(f"Profile written to {dump_path}")
+
+    def _dump(self):
+        if self._profiler is None:
+            return None
+        os.makedirs(self._dump_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if self._engine == 'pyinstrument':
+            path = os.path.join(self._dump_dir, f"rerun-{stamp}-{id(self):x}.html")
+            with open(path, 'w') as f:
+                f.write(self._profiler.output_html())
+        else:
+            path = os.path.join(self._dump_dir, f"rerun-{stamp}-{id(self):x}.prof")
+            self._profiler.dump_stats(path)
+        return path
+
+
+def begin_rerun():
+    # Stop any profiler left running by a rerun that ended early
+    leftover = getattr(_local, 'profiler', None)
+    if leftover is not None:
+        leftover.stop()
+    return RerunProfiler()
+
+
+def timed(fn):
+    """Record the wall time of fn in the active rerun profile, if any"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is None:
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.record_call(fn.__name__, time.perf_counter() - started)
+    return wrapper
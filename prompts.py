@@ -0,0 +1,49 @@
+"""
+Versioned prompt template for panel summaries.
+
+The instructions are a module constant sent as the system message, so every
+job starts with byte-identical tokens. With the model kept loaded (see
+llm.OllamaBackend keep_alive), ollama reuses the KV cache for that shared
+prefix and only evaluates the per-file data that follows. Any change to
+SYSTEM_PROMPT must bump PROMPT_VERSION so summaries can be traced back to
+the template that produced them.
+"""
+
+PROMPT_VERSION = 'summary-v2'
+
+SYSTEM_PROMPT = """You are a health assistant. Given blood test data, do the following:
+
+1. Summarize the test panel
+2. Identify any abnormal values. For each test:
+- Use the reference range for comparison
+- If the reference range is a range (e.g., 13.0 - 17.0), check if the value is inside it.
+- If the reference range is a bound (e.g., < 200 or > 40), compare accordingly.
+3. For each abnormal value, suggest one evidence-based dietary change.
+4. Clearly separate "Abnormal Results" and "Normal Results" in your response.
+
+Each line of the data is: test name: value unit (Reference Range: range)"""
+
+
+def format_panel(df):
+    """Compact one-line-per-test data block, built column-wise rather than row by row"""
+    lines = (df['test_name'].astype(str) + ': ' + df['value'].astype(str) + ' '
+             + df['unit'].astype(str) + ' (Reference Range: ' + df['reference_range'].astype(str) + ')')
+    return '\n'.join(lines)
+
+
+def build_messages(df):
+    """Chat messages for one panel: the shared system prefix, then this file's data"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": format_panel(df)},
+    ]
+
+
+def build_messages_without_prefix(df):
+    """
+    Same content with the data first, so no two jobs share a prefix. Only used
+    by the benchmark as the no-reuse baseline.
+    """
+    return [
+        {"role": "user", "content": format_panel(df) + "\n\n" + SYSTEM_PROMPT},
+    ]
@@ -0,0 +1,153 @@
+"""
+Downloadable analysis reports for the "Share with Provider" card.
+
+A report is one self-contained HTML file with the classified results table,
+the results plot (inline PNG) and the AI summary. Its key is a SHA-256 over
+those inputs plus REPORT_VERSION. Identical inputs always map to the same
+artifact, so a report is built once and every later download is served from
+cache: in-process first, then reports/<digest>.html in S3.
+
+Building runs on a background executor. The script thread only hashes the
+inputs, which takes microseconds, and polls for the finished bytes.
+"""
+import base64
+import hashlib
+import html
+import threading
+import time
+
+import pandas as pd
+
+from botocore.exceptions import ClientError
+
+import lrucache
+import s3errors
+import storage
+
+REPORT_VERSION = 'report-v1'
+REPORT_PREFIX = 'reports/'
+
+
+def report_digest(df, plot_png, summary):
+    digest = hashlib.sha256(REPORT_VERSION.encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    digest.update(b'\0' + ','.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(b'\0' + plot_png)
+    digest.update(b'\0' + (summary or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def report_key(digest):
+    return f"{REPORT_PREFIX}{digest}.html"
+
+
+def _status_color(status):
+    if 'Normal' in status:
+        return '#e8f8ef'
+    if 'High' in status or 'Low' in status:
+        return '#fdecea'
+    return '#f4f4f4'
+
+
+def render_html(result_df, plot_png, summary, title="Bloodwork Analysis"):
+    """result_df is classified (has a status column); returns UTF-8 HTML bytes"""
+    columns = [c for c in ('panel_category', 'test_name', 'value', 'unit', 'reference_range', 'status')
+               if c in result_df.columns]
+    header = ''.join(f"<th>{html.escape(c.replace('_', ' ').title())}</th>" for c in columns)
+    rows = []
+    for record in result_df[columns].astype(str).itertuples(index=False):
+        status = record[columns.index('status')] if 'status' in columns else ''
+        cells = ''.join(f"<td>{html.escape(value)}</td>" for value in record)
+        rows.append(f'<tr style="background:{_status_color(status)}">{cells}</tr>')
+    plot = base64.b64encode(plot_png).decode('ascii')
+    generated = time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime())
+
+    document = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+  body {{ font-family: 'Helvetica Neue', Arial, sans-serif; color: #2c3e50; max-width: 960px; margin: 2em auto; }}
+  h1, h2 {{ color: #3498db; }}
+  table {{ border-collapse: collapse; width: 100%; }}
+  th, td {{ border: 1px solid #dde3ea; padding: 6px 10px; text-align: left; }}
+  th {{ background: #f1f7fd; }}
+  .summary {{ white-space: pre-line; background: #fff; padding: 1em; border: 1px solid #dde3ea; border-radius: 8px; }}
+  footer {{ margin-top: 2em; font-size: 0.85em; color: #7f8c8d; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<p>Generated {generated}</p>
+<h2>Results</h2>
+<table><thead><tr>{header}</tr></thead><tbody>{''.join(rows)}</tbody></table>
+<h2>Results Chart</h2>
+<img alt="Blood test results chart" style="max-width: 100%" src="data:image/png;base64,{plot}">
+<h2>AI-Generated Summary</h2>
+<div class="summary">{html.escape(summary or '')}</div>
+<footer>This report is an educational analysis only and not medical advice.</footer>
+</body>
+</html>
+"""
+    return document.encode('utf-8')
+
+
+def build_report(digest, classify, df, plot_png, summary, title, s3=None, bucket=None):
+    """
+    Returns the report bytes for digest. It is read from S3 if it was built
+    before, otherwise rendered and stored there. classify(df) produces the
+    status column. Meant to run on a background thread.
+    """
+    if s3 is not None:
+        try:
+            return storage.read_body(s3.get_object(Bucket=bucket, Key=report_key(digest)))
+        except ClientError as e:
+            if not s3errors.is_missing(e):
+                raise
+    data = render_html(classify(df), plot_png, summary, title)
+    if s3 is not None:
+        storage.put_object(s3, bucket, report_key(digest), data, {'report-version': REPORT_VERSION},
+                           ContentType='text/html; charset=utf-8')
+    return data
+
+
+class ReportBuilder:
+    """Runs build_report on an executor, one build per digest at a time"""
+
+    def __init__(self, executor, cache=None):
+        self.executor = executor
+        self.cache = cache or lrucache.LRUCache(max_entries=32)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def request(self, df, plot_png, summary, classify, title="Bloodwork Analysis", s3=None, bucket=None):
+        """Starts building the report unless it is cached or already building. Returns its digest."""
+        digest = report_digest(df, plot_png, summary)
+        if self.cache.get(digest) is not None:
+            return digest
+        with self._lock:
+            future = self._futures.get(digest)
+            if future is None or (future.done() and future.exception() is not None):
+                self._futures[digest] = self.executor.submit(
+                    self._build, digest, classify, df.copy(), plot_png, summary, title, s3, bucket)
+        return digest
+
+    def _build(self, digest, *args):
+        data = build_report(digest, *args)
+        self.cache.put(digest, data)
+        # Served from the cache from now on; a failed build keeps its future so result() can raise
+        with self._lock:
+            self._futures.pop(digest, None)
+        return data
+
+    def result(self, digest):
+        """Report bytes once built, else None. Raises the build error if it failed."""
+        data = self.cache.get(digest)
+        if data is not None:
+            return data
+        with self._lock:
+            future = self._futures.get(digest)
+        if future is not None and future.done():
+            return future.result()
+        return None
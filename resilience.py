@@ -0,0 +1,244 @@
+"""
+Timeouts, retries and circuit breakers for calls to S3, RDS and the LLM.
+
+Each dependency has a Policy made up of:
+- a per-attempt timeout
+- a number of attempts, with full-jitter exponential backoff between them
+- a CircuitBreaker
+
+When too many consecutive calls fail, the breaker opens. While it is open,
+calls fail immediately with CircuitOpenError, so a job that needs a down
+dependency does not sit through every retry. After the reset time, one trial
+call is let through. If it succeeds, the breaker closes again.
+
+Only transient failures are retried and counted against the breaker:
+connection errors, timeouts, throttling and 5xx responses. Answers such as
+S3 404/412 or an SQL error are passed straight to the caller.
+
+S3 clients built with s3_client() put every API call through the breaker.
+The retries happen inside botocore, whose standard mode already uses
+jittered exponential backoff, so attempts are not multiplied.
+
+Configured from the environment, per dependency (S3, RDS, LLM):
+    <DEP>_RETRY_ATTEMPTS    attempts per call (s3 4, rds 3, llm 2)
+    <DEP>_RETRY_BASE        backoff ceiling before the first retry, seconds (rds 0.5, llm 1)
+    <DEP>_BREAKER_FAILURES  consecutive failures that open the breaker (default 5)
+    <DEP>_BREAKER_RESET     seconds the breaker stays open (default 30)
+    S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT    default 5 and 30 seconds
+    RDS_CONNECT_TIMEOUT, RDS_STATEMENT_TIMEOUT  default 5 and 30 seconds
+The LLM call timeout is LLM_TIMEOUT in llm.py.
+"""
+import functools
+import os
+import random
+import threading
+import time
+
+import metrics
+import s3errors
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+
+def _env(dependency, setting, default):
+    return float(os.environ.get(f"{dependency.upper()}_{setting}", default))
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            self.state = state
+            metrics.inc('circuit_breaker_transitions_total', dependency=self.name, state=state)
+            print(f"⚡ {self.name} circuit breaker {state}")
+
+    @property
+    def is_open(self):
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+                self._transition('half_open')
+            if self.state == 'half_open':
+                # One trial call at a time decides whether to close again
+                if self._trial_running:
+                    raise CircuitOpenError(f"{self.name} is unavailable (circuit half-open)")
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition('open')
+
+
+def _s3_transient(error):
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or s3errors.error_code(error) in s3errors.TRANSIENT_CODES
+    return False
+
+
+def _rds_transient(error):
+    try:
+        import psycopg2
+    except ImportError:
+        return False
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def _llm_transient(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    # ollama.ResponseError carries the HTTP status of the server's answer
+    status = getattr(error, 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+class Policy:
+    def __init__(self, name, attempts, base_delay, max_delay, is_transient, breaker):
+        self.name = name
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_transient = is_transient
+        self.breaker = breaker
+
+    def backoff(self, attempt):
+        """Full jitter: uniform between 0 and the exponential ceiling"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def _policy(name, attempts, base_delay, max_delay, is_transient):
+    breaker = CircuitBreaker(name, int(_env(name, 'BREAKER_FAILURES', 5)), _env(name, 'BREAKER_RESET', 30))
+    return Policy(name, _env(name, 'RETRY_ATTEMPTS', attempts), _env(name, 'RETRY_BASE', base_delay),
+                  max_delay, is_transient, breaker)
+
+
+def _s3_policy():
+    # botocore retries S3 itself (see s3_client), so this layer makes one attempt
+    breaker = CircuitBreaker('s3', int(_env('s3', 'BREAKER_FAILURES', 5)), _env('s3', 'BREAKER_RESET', 30))
+    return Policy('s3', 1, 0.0, 0.0, _s3_transient, breaker)
+
+
+POLICIES = {
+    's3': _s3_policy(),
+    'rds': _policy('rds', 3, 0.5, 8.0, _rds_transient),
+    'llm': _policy('llm', 2, 1.0, 10.0, _llm_transient),
+}
+
+
+def breaker(dependency):
+    return POLICIES[dependency].breaker
+
+
+def call(dependency, fn, *args, **kwargs):
+    """Runs fn under the dependency's breaker, retrying transient failures"""
+    policy = POLICIES[dependency]
+    for attempt in range(policy.attempts):
+        try:
+            policy.breaker.before_call()
+        except CircuitOpenError:
+            metrics.inc('dependency_calls_total', dependency=dependency, status='rejected')
+            raise
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except CircuitOpenError:
+            # A nested call was rejected; that says nothing about this attempt
+            raise
+        except Exception as e:
+            metrics.observe('dependency_call_seconds', time.perf_counter() - started, dependency=dependency)
+            if not policy.is_transient(e):
+                # The dependency answered; the error is the caller's to handle
+                policy.breaker.record_success()
+                metrics.inc('dependency_calls_total', dependency=dependency, status='error')
+                raise
+            policy.breaker.record_failure()
+            if attempt + 1 >= policy.attempts:
+                metrics.inc('dependency_calls_total', dependency=dependency, status='failed')
+                raise
+            metrics.inc('dependency_calls_total', dependency=dependency, status='retry')
+            time.sleep(policy.backoff(attempt))
+            continue
+        metrics.observe('dependency_call_seconds', time.perf_counter() - started, dependency=dependency)
+        policy.breaker.record_success()
+        metrics.inc('dependency_calls_total', dependency=dependency, status='ok')
+        return result
+
+
+class ResilientClient:
+    """boto3 client proxy that sends every API operation through call()"""
+
+    def __init__(self, client, dependency='s3'):
+        self._client = client
+        self._dependency = dependency
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in self._client.meta.method_to_api_mapping:
+            return functools.partial(call, self._dependency, attr)
+        # Paginators, waiters, exceptions, meta and transfer helpers pass through
+        return attr
+
+
+def s3_client(**kwargs):
+    """boto3 S3 client with connect/read timeouts, jittered retries and the s3 breaker"""
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        connect_timeout=_env('s3', 'CONNECT_TIMEOUT', 5),
+        read_timeout=_env('s3', 'READ_TIMEOUT', 30),
+        retries={'mode': 'standard', 'max_attempts': int(_env('s3', 'RETRY_ATTEMPTS', 4))},
+    )
+    return ResilientClient(boto3.client('s3', config=config, **kwargs))
+
+
+def open_rds(**db_config):
+    """
+    psycopg2 connection with connect and statement timeouts, in a single
+    attempt. For use inside a call('rds', ...) that also runs the query.
+    """
+    import psycopg2
+
+    db_config.setdefault('connect_timeout', int(_env('rds', 'CONNECT_TIMEOUT', 5)))
+    statement_ms = int(_env('rds', 'STATEMENT_TIMEOUT', 30) * 1000)
+    db_config.setdefault('options', f"-c statement_timeout={statement_ms}")
+    return psycopg2.connect(**db_config)
+
+
+def connect_rds(**db_config):
+    """open_rds, retried under the rds policy"""
+    return call('rds', open_rds, **db_config)
@@ -0,0 +1,25 @@
+"""
+S3 error codes shared by the modules that call S3 directly.
+
+botocore reports the same condition under different codes depending on the
+operation: a missing object is NoSuchKey on GET but a bare 404 or NotFound on
+HEAD, and a lost conditional write is 412 or, while another one is in flight, 409.
+"""
+MISSING_CODES = {'404', 'NoSuchKey', 'NotFound'}
+CONFLICT_CODES = {'PreconditionFailed', '412', 'ConditionalRequestConflict', '409'}
+# Worth retrying: throttling and server-side failures
+TRANSIENT_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestTimeout',
+                   'ServiceUnavailable', 'InternalError'}
+
+
+def error_code(error):
+    """The S3 error code of a botocore ClientError, as a string"""
+    return str(error.response.get('Error', {}).get('Code', ''))
+
+
+def is_missing(error):
+    return error_code(error) in MISSING_CODES
+
+
+def is_conflict(error):
+    return error_code(error) in CONFLICT_CODES
@@ -0,0 +1,93 @@
+"""
+Urgency-ordered dispatch of summarization jobs for ec2.py.
+
+Each panel is scored from its own reference ranges when the app writes its
+trigger. The score travels in the trigger body, so the worker can order its
+queue without downloading any panel. Every out-of-range value adds one point
+plus its distance outside the range, measured in range widths (or as a
+fraction of the bound for '< x' / '> x' ranges). Tests where abnormal values
+are dangerous are weighted up. Jobs also age: each minute a job waits adds
+AGING_PER_MINUTE points, so routine panels are never starved.
+
+Aging grows at the same rate for every job, so score + rate * (now - enqueued)
+ranks jobs the same way as score - rate * enqueued. That lets a plain heap keep
+the order without re-scoring as time passes.
+"""
+import heapq
+import itertools
+import os
+import time
+
+import pandas as pd
+
+AGING_PER_MINUTE = float(os.environ.get('SCHEDULER_AGING_PER_MINUTE', '0.5'))
+
+# Cap per value so one absurd reading (e.g. a unit mix-up) can't dominate
+MAX_DEVIATION = 10.0
+
+# Canonical test -> weight applied to its abnormal-value score
+TEST_WEIGHTS = {
+    'Potassium': 3.0,
+    'Sodium': 2.0,
+    'Calcium': 2.0,
+    'Glucose': 2.0,
+    'Hemoglobin': 1.5,
+    'Platelets': 1.5,
+    'WBC': 1.5,
+}
+
+_RANGE_PATTERN = r'^\s*(?:(?P<op>[<>])\s*(?P<bound>-?\d+(?:\.\d+)?)|(?P<lower>-?\d+(?:\.\d+)?)\s*-\s*(?P<upper>-?\d+(?:\.\d+)?))\s*$'
+
+
+def severity_score(df):
+    """Urgency score for one panel; 0 means every value is in range or unknown"""
+    if df is None or df.empty or 'reference_range' not in df.columns or 'value' not in df.columns:
+        return 0.0
+
+    ranges = df['reference_range'].astype(str).str.extract(_RANGE_PATTERN)
+    values = pd.to_numeric(df['value'], errors='coerce')
+    lower = pd.to_numeric(ranges['lower'], errors='coerce')
+    upper = pd.to_numeric(ranges['upper'], errors='coerce')
+    bound = pd.to_numeric(ranges['bound'], errors='coerce')
+
+    width = (upper - lower).where(lambda w: w > 0)
+    deviation = pd.Series(0.0, index=df.index)
+    deviation = deviation.mask(values < lower, (lower - values) / width)
+    deviation = deviation.mask(values > upper, (values - upper) / width)
+
+    scale = bound.abs().where(lambda b: b > 0)
+    above = (ranges['op'] == '<') & (values > bound)
+    below = (ranges['op'] == '>') & (values < bound)
+    deviation = deviation.mask(above, (values - bound) / scale)
+    deviation = deviation.mask(below, (bound - values) / scale)
+
+    deviation = deviation.fillna(0.0).clip(upper=MAX_DEVIATION)
+    abnormal = deviation > 0
+    if 'test_name' in df.columns:
+        weights = df['test_name'].astype(str).map(TEST_WEIGHTS).fillna(1.0)
+    else:
+        weights = 1.0
+    return float(((abnormal + deviation) * weights).sum())
+
+
+class UrgencyQueue:
+    """Max-priority queue on severity plus waiting time"""
+
+    def __init__(self, aging_per_minute=AGING_PER_MINUTE):
+        self.aging_per_second = aging_per_minute / 60.0
+        self._heap = []
+        # Tie-breaker keeps FIFO order among equal priorities
+        self._counter = itertools.count()
+
+    def push(self, job, score, enqueued_at=None):
+        enqueued_at = time.time() if enqueued_at is None else enqueued_at
+        key = score - self.aging_per_second * enqueued_at
+        heapq.heappush(self._heap, (-key, next(self._counter), score, enqueued_at, job))
+
+    def pop(self):
+        """Returns (job, score, enqueued_at) for the most urgent job"""
+        _, _, score, enqueued_at, job = heapq.heappop(self._heap)
+        return job, score, enqueued_at
+
+    def __len__(self):
+        return len(self._heap)
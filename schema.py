@@ -0,0 +1,193 @@
+"""
+Shared schema for bloodwork CSVs, used by app.py and ec2.py.
+
+read_bloodwork_csv reads with declared dtypes instead of letting pandas infer
+them. Text columns with few distinct values are categoricals, value is float64
+and date is datetime64. Only known columns are loaded, and the pyarrow parser
+is used when it is installed. If the fast typed read fails on a malformed file,
+or any row has a different number of fields than the header, the file is
+re-read tolerantly: rows with the wrong number of fields are skipped,
+unparseable values become NaN, and every problem is returned in a
+list of issues instead of failing the whole file.
+"""
+import csv
+import io
+import warnings
+
+import pandas as pd
+
+COLUMNS = ['panel_category', 'test_name', 'date', 'value', 'unit', 'reference_range']
+
+CATEGORICAL_COLUMNS = ['panel_category', 'test_name', 'unit']
+NUMERIC_COLUMNS = ['value']
+DATE_COLUMNS = ['date']
+
+# dtypes applied at parse time; categoricals are converted after the read so
+# every parser engine handles them the same way
+READ_DTYPES = {
+    'panel_category': 'object',
+    'test_name': 'object',
+    'unit': 'object',
+    'reference_range': 'object',
+    'value': 'float64',
+    'date': 'object',
+}
+
+try:
+    import pyarrow  # noqa: F401
+    FAST_ENGINE = 'pyarrow'
+except ImportError:
+    FAST_ENGINE = 'c'
+
+
+def _open(source):
+    """A fresh binary handle on bytes or a path, so the file can be read twice"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+
+def _header(source):
+    with _open(source) as handle:
+        first_line = handle.readline().decode('utf-8-sig')
+    return next(csv.reader([first_line.rstrip('\r\n')]), [])
+
+
+def _finish(df, issues):
+    """Applies the post-read types and records rows whose date didn't parse"""
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            raw = df[column]
+            df[column] = pd.to_datetime(raw, errors='coerce')
+            bad = df[column].isna() & raw.notna()
+            for index in df.index[bad]:
+                issues.append({'row': int(index) + 2, 'column': column,
+                               'problem': f"unparseable date {raw[index]!r}"})
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def _fast_read(source, usecols, dtypes):
+    with _open(source) as handle:
+        return pd.read_csv(handle, engine=FAST_ENGINE, usecols=usecols, dtype=dtypes)
+
+
+def _read_bytes(source):
+    with _open(source) as handle:
+        return handle.read()
+
+
+def _rows_match_header(data, n_fields):
+    """
+    True if every non-blank line has the header's number of fields. Lines
+    without quotes are checked by counting commas, which is much faster than
+    parsing them.
+    """
+    expected = n_fields - 1
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        if b'"' not in line:
+            if line.count(b',') != expected:
+                return False
+        elif line.count(b'"') % 2:
+            # A quoted field spans lines; parse the whole file instead
+            reader = csv.reader(io.StringIO(data.decode('utf-8-sig'), newline=''))
+            return all(len(fields) == n_fields for fields in reader if fields)
+        elif len(next(csv.reader([line.decode('utf-8-sig')]))) != n_fields:
+            return False
+    return True
+
+
+def _tolerant_read(data, header, usecols, issues):
+    records, line_numbers = [], []
+    reader = csv.reader(io.StringIO(data.decode('utf-8-sig'), newline=''))
+    next(reader, None)
+    for fields in reader:
+        if not fields:
+            continue
+        if len(fields) != len(header):
+            issues.append({'row': reader.line_num, 'column': None,
+                           'problem': f"wrong number of fields ({len(fields)}, expected {len(header)}): "
+                                      f"{','.join(fields)[:80]}"})
+            continue
+        records.append([field if field != '' else None for field in fields])
+        line_numbers.append(reader.line_num)
+
+    # Indexed by row number - 2, so the issues below point at the right line
+    df = pd.DataFrame(records, columns=header, index=[n - 2 for n in line_numbers], dtype='object')[usecols]
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            raw = df[column]
+            df[column] = pd.to_numeric(raw, errors='coerce')
+            bad = df[column].isna() & raw.notna()
+            for index in df.index[bad]:
+                issues.append({'row': int(index) + 2, 'column': column,
+                               'problem': f"non-numeric value {raw[index]!r}"})
+    return df
+
+
+def read_bloodwork_csv(source):
+    """
+    Reads a bloodwork CSV from raw bytes or a file path.
+    Returns (df, issues), where issues lists the rows that could not be read
+    cleanly (row numbers count the header as row 1).
+    """
+    header = _header(source)
+    usecols = [column for column in header if column in COLUMNS]
+    if not usecols:
+        raise ValueError(f"no bloodwork columns found in header: {header}")
+    dtypes = {column: READ_DTYPES[column] for column in usecols}
+
+    issues = []
+    data = _read_bytes(source)
+    df = None
+    # pyarrow rejects rows with the wrong number of fields, but the C parser
+    # pads short rows and, with usecols, drops extra fields without a word
+    if FAST_ENGINE == 'pyarrow' or _rows_match_header(data, len(header)):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', pd.errors.ParserWarning)
+                df = _fast_read(data, usecols, dtypes)
+        except (ValueError, pd.errors.ParserError, pd.errors.ParserWarning):
+            pass
+    if df is None:
+        df = _tolerant_read(data, header, usecols, issues)
+    return _finish(df, issues).reset_index(drop=True), issues
+
+
+def frame_from_rows(rows):
+    """
+    Typed frame from row dicts already parsed in memory, or from the
+    preproc.NormalizedRows table that preprocess_bloodwork_data returns.
+    Returns (df, issues) like read_bloodwork_csv.
+    """
+    columns = [column for column in COLUMNS if not rows or column in rows[0]]
+    if rows and hasattr(rows, 'column'):
+        # preproc.NormalizedRows: build from whole columns instead of row by row
+        df = pd.DataFrame({column: rows.column(column) for column in columns}, columns=columns)
+    else:
+        df = pd.DataFrame.from_records(list(rows), columns=columns)
+    df = df.astype(
+        {column: READ_DTYPES[column] for column in columns if READ_DTYPES[column] == 'object'})
+    issues = []
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+            for index in df.index[df[column].isna()]:
+                issues.append({'row': int(index) + 2, 'column': column,
+                               'problem': "missing or non-numeric value"})
+    return _finish(df, issues), issues
+
+
+def format_issues(issues, limit=5):
+    """Short human-readable summary of read issues"""
+    lines = []
+    for issue in issues[:limit]:
+        where = f"row {issue['row']}" if issue['row'] is not None else "row"
+        lines.append(f"{where}: {issue['problem']}")
+    if len(issues) > limit:
+        lines.append(f"... and {len(issues) - limit} more")
+    return '\n'.join(lines)
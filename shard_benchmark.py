@@ -0,0 +1,171 @@
+"""
+Multi-process throughput benchmark for sharded ec2.py workers.
+
+Starts a local S3 stand-in (moto server, which needs moto[server]), or uses
+--endpoint-url to point at MinIO/LocalStack. For each worker count N it
+queues the same synthetic files, then starts N worker processes with
+SHARD_COUNT=N, one SHARD_INDEX each. The stub LLM backend simulates the
+per-file inference time. The clock starts once every process has finished
+importing. The run ends when the queue is empty, and every file must have
+been summarized exactly once.
+
+Usage:
+    python shard_benchmark.py --workers 1 2 4 8 --files 200 --latency 0.5
+    python shard_benchmark.py --workers 4 --unsharded   # all workers contend for every key
+"""
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import boto3
+
+ENV = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+
+def _client(endpoint):
+    return boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1',
+                        aws_access_key_id='testing', aws_secret_access_key='testing')
+
+
+def _empty(s3, bucket):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': keys})
+
+
+def seed(endpoint, n_files, rows_per_file):
+    import ec2
+    from benchmark import synthetic_csv_bytes
+
+    s3 = _client(endpoint)
+    for bucket in (ec2.bucket_raw, ec2.bucket_proc):
+        try:
+            s3.create_bucket(Bucket=bucket)
+        except s3.exceptions.BucketAlreadyOwnedByYou:
+            pass
+        _empty(s3, bucket)
+    for i in range(n_files):
+        filename = f"panel_{i:05d}.csv"
+        s3.put_object(Bucket=ec2.bucket_raw, Key=filename, Body=synthetic_csv_bytes(rows_per_file, seed=i))
+        s3.put_object(Bucket=ec2.bucket_proc, Key=f"{ec2.trigger_prefix}{filename}.txt",
+                      Body=json.dumps({'filename': filename}).encode('utf-8'))
+
+
+def _worker(endpoint, index, count, sharded, latency, ready, go, results):
+    os.environ.update(ENV)
+    import ec2
+    import llm
+    import sharding
+
+    s3 = _client(endpoint)
+    backend = llm.StubBackend(latency=latency)
+    worker_id = f"bench-{index}"
+    membership = sharding.StaticMembership(index, count) if sharded else None
+
+    ready.release()
+    go.wait()
+    completed = 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while True:
+            shard = membership.shard() if membership else None
+            completed += ec2.run_worker(s3, backend, worker_id, shard)
+            remaining = s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix=ec2.trigger_prefix).get('Contents', [])
+            if shard is not None:
+                remaining = [t for t in remaining if shard.owns(ec2.trigger_filename(t['Key']))]
+            if not remaining:
+                break
+            time.sleep(0.05)
+    results.put((index, completed, backend.calls))
+
+
+def run_once(endpoint, n_workers, n_files, latency, sharded, rows_per_file=12):
+    seed(endpoint, n_files, rows_per_file)
+    ctx = multiprocessing.get_context('spawn')
+    ready, go, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(endpoint, i, n_workers, sharded, latency, ready, go, results))
+             for i in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.acquire()
+
+    started = time.perf_counter()
+    go.set()
+    per_worker = sorted((results.get() for _ in procs), key=lambda r: r[0])
+    elapsed = time.perf_counter() - started
+    for proc in procs:
+        proc.join()
+
+    import ec2
+    s3 = _client(endpoint)
+    summaries = s3.list_objects_v2(Bucket=ec2.bucket_proc, Prefix='summaries/').get('KeyCount', 0)
+    completed = sum(done for _, done, _ in per_worker)
+    llm_calls = sum(calls for _, _, calls in per_worker)
+    assert summaries == n_files, f"expected {n_files} summaries, found {summaries}"
+    assert completed == n_files, f"workers reported {completed} completions for {n_files} files"
+    return {
+        'workers': n_workers,
+        'sharded': sharded,
+        'seconds': elapsed,
+        'files_per_second': n_files / elapsed,
+        'per_worker': [done for _, done, _ in per_worker],
+        'llm_calls': llm_calls,
+    }
+
+
+@contextlib.contextmanager
+def s3_stand_in(endpoint=None, port=5055):
+    if endpoint:
+        yield endpoint
+        return
+    from moto.server import ThreadedMotoServer
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput scaling of sharded ec2.py workers.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help="Simulated seconds per LLM call")
+    parser.add_argument('--unsharded', action='store_true', help="Run without sharding for comparison")
+    parser.add_argument('--endpoint-url', help="Existing S3-compatible endpoint instead of moto server")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ.update(ENV)
+    rows = []
+    with s3_stand_in(args.endpoint_url) as endpoint:
+        for n in args.workers:
+            rows.append(run_once(endpoint, n, args.files, args.latency, not args.unsharded))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+    base = rows[0]['files_per_second'] / rows[0]['workers']
+    print(f"{'workers':>7} {'files/s':>9} {'speedup':>8} {'efficiency':>10} {'llm calls':>9}  per worker")
+    for row in rows:
+        speedup = row['files_per_second'] / base
+        print(f"{row['workers']:>7} {row['files_per_second']:>9.1f} {speedup:>8.2f} "
+              f"{speedup / row['workers']:>10.0%} {row['llm_calls']:>9}  {row['per_worker']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Sharding of the to-process/ queue across several ec2.py processes or hosts.
+
+Each trigger belongs to one shard, picked by consistent hashing of its file
+name onto a ring of virtual nodes. A worker only pre-scores, claims and
+summarizes the triggers its shard owns, so workers no longer download and
+contend for the same keys. Leases (leases.py) still guard the handover while
+the ring changes. Adding or removing a shard moves only about 1/N of the keys.
+
+The ring is sized in one of two ways:
+    static  SHARD_COUNT=N and SHARD_INDEX=i; the ring holds shard-0 .. shard-(N-1)
+    auto    SHARD_COUNT=auto; each worker heartbeats workers/<id>.json in the
+            processed bucket from a background thread, every third of
+            SHARD_HEARTBEAT_TTL (default 120s), so a long pass never expires
+            it. The ring is rebuilt from the live heartbeats every pass, so
+            it rebalances as workers join or leave
+
+With static sharding, a worker also takes up to SHARD_MAX_STEALS (default 1)
+of the oldest other-shard triggers per pass, once they have waited longer than
+SHARD_STEAL_AFTER seconds (default 600, 0 disables). A dead static shard
+therefore cannot strand its keys. Because steals are bounded, a deep backlog
+doesn't bring back contention for every key. Auto membership never steals:
+its ring holds only workers with a live heartbeat, and a dead worker's keys
+move to the others once its heartbeat expires.
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+MEMBER_PREFIX = 'workers/'
+DEFAULT_VNODES = 256
+HEARTBEAT_TTL = float(os.environ.get('SHARD_HEARTBEAT_TTL', '120'))
+STEAL_AFTER = float(os.environ.get('SHARD_STEAL_AFTER', '600'))
+MAX_STEALS = int(os.environ.get('SHARD_MAX_STEALS', '1'))
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring; each node is placed at vnodes points to even out the load"""
+
+    def __init__(self, nodes, vnodes=DEFAULT_VNODES):
+        if not nodes:
+            raise ValueError("a hash ring needs at least one node")
+        points = sorted((_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self.nodes = sorted(set(nodes))
+
+    def owner(self, key):
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[i]
+
+
+class Shard:
+    """One worker's slice of the queue"""
+
+    def __init__(self, node, ring, steal_after=STEAL_AFTER, max_steals=MAX_STEALS):
+        self.node = node
+        self.ring = ring
+        self.steal_after = steal_after
+        self.max_steals = max_steals
+
+    def owns(self, name):
+        return self.ring.owner(name) == self.node
+
+    def select(self, items, name, queued_at):
+        """
+        The items to work on this pass: those this shard owns, plus at most
+        max_steals of the oldest other-shard items past the steal deadline.
+        name(item) and queued_at(item) give an item's key and queue time.
+        """
+        mine, overdue = [], []
+        cutoff = time.time() - self.steal_after
+        for item in items:
+            if self.owns(name(item)):
+                mine.append(item)
+            elif self.steal_after and self.max_steals and queued_at(item) < cutoff:
+                overdue.append(item)
+        overdue.sort(key=queued_at)
+        return mine + overdue[:self.max_steals]
+
+    def __repr__(self):
+        return f"Shard({self.node!r} of {len(self.ring.nodes)})"
+
+
+class StaticMembership:
+    """Fixed shard index/count, e.g. one per host in a deployment"""
+
+    def __init__(self, index, count):
+        if not 0 <= index < count:
+            raise ValueError(f"SHARD_INDEX {index} out of range for SHARD_COUNT {count}")
+        self.node = f"shard-{index}"
+        self.ring = HashRing([f"shard-{i}" for i in range(count)])
+
+    def shard(self, steal_after=STEAL_AFTER, max_steals=MAX_STEALS):
+        return Shard(self.node, self.ring, steal_after, max_steals)
+
+    def leave(self):
+        pass
+
+
+class Membership:
+    """Live worker set, kept as heartbeat objects so the ring follows the worker count"""
+
+    def __init__(self, s3, bucket, worker_id, ttl=HEARTBEAT_TTL):
+        self.s3 = s3
+        self.bucket = bucket
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                # Keep trying; peers only drop this worker once the TTL runs out
+                print(f"⚠️ Heartbeat failed for {self.worker_id}: {e}")
+
+    def heartbeat(self):
+        body = json.dumps({'worker_id': self.worker_id, 'seen_at': time.time()}).encode('utf-8')
+        self.s3.put_object(Bucket=self.bucket, Key=f"{MEMBER_PREFIX}{self.worker_id}.json", Body=body)
+
+    def live_members(self):
+        # LastModified is enough to judge liveness, so no per-member GET is needed
+        cutoff = time.time() - self.ttl
+        members = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=MEMBER_PREFIX):
+            for obj in page.get('Contents', []):
+                if obj['LastModified'].timestamp() >= cutoff:
+                    members.append(obj['Key'][len(MEMBER_PREFIX):-len('.json')])
+        return members
+
+    def shard(self):
+        """Heartbeats, then returns this worker's shard of the current membership"""
+        self.heartbeat()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._beat, daemon=True)
+            self._thread.start()
+        members = self.live_members()
+        if self.worker_id not in members:
+            members.append(self.worker_id)
+        # Every owner on this ring is alive, if busy, so there is nothing to steal
+        return Shard(self.worker_id, HashRing(members), steal_after=0)
+
+    def leave(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=f"{MEMBER_PREFIX}{self.worker_id}.json")
+        except ClientError:
+            # The heartbeat simply expires
+            pass
+
+
+def from_env(s3, bucket, worker_id):
+    """
+    Membership configured by SHARD_COUNT / SHARD_INDEX, or None when
+    SHARD_COUNT is unset and every worker considers every trigger. Call
+    .shard() once per pass and .leave() on shutdown.
+    """
+    count = os.environ.get('SHARD_COUNT', '').strip().lower()
+    if not count:
+        return None
+    if count == 'auto':
+        return Membership(s3, bucket, worker_id)
+    return StaticMembership(int(os.environ.get('SHARD_INDEX', '0')), int(count))
@@ -0,0 +1,96 @@
+"""
+Compressed object storage for the pipeline buckets.
+
+Writers go through put_object, which compresses the body with the configured
+codec. It records the codec in both Content-Encoding and the storage-codec
+metadata key, so any reader can tell how the object was stored. Readers go
+through open_body / read_body, which decompress while streaming from the
+response. Objects written before this module existed have neither marker and
+are read as-is.
+
+Configured from the environment:
+    STORAGE_CODEC   gzip (default), zstd or none. zstd needs the zstandard
+                    package and falls back to gzip for writes without it.
+    STORAGE_LEVEL   compression level, default 6 for gzip and 3 for zstd
+"""
+import gzip
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_METADATA_KEY = 'storage-codec'
+CODECS = ('gzip', 'zstd', 'none')
+
+_DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+
+def get_codec(codec=None):
+    """Resolves the codec to write with, falling back to gzip when zstd is unavailable"""
+    codec = (codec or os.environ.get('STORAGE_CODEC', 'gzip')).strip().lower()
+    if codec in ('', 'identity'):
+        codec = 'none'
+    if codec not in CODECS:
+        raise ValueError(f"unknown STORAGE_CODEC {codec!r} (expected one of {', '.join(CODECS)})")
+    if codec == 'zstd' and zstandard is None:
+        return 'gzip'
+    return codec
+
+
+def _level(codec):
+    level = os.environ.get('STORAGE_LEVEL')
+    return int(level) if level else _DEFAULT_LEVELS[codec]
+
+
+def compress(data, codec):
+    if codec == 'gzip':
+        # mtime=0 keeps the output byte-identical for identical input
+        return gzip.compress(data, compresslevel=_level(codec), mtime=0)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=_level(codec)).compress(data)
+    return data
+
+
+def put_object(s3, bucket, key, data, metadata=None, codec=None, **kwargs):
+    """
+    Compresses data (bytes or str) and stores it. The caller's metadata is
+    kept, but a codec marker copied from a source object is replaced.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    codec = get_codec(codec)
+    metadata = dict(metadata or {})
+    metadata.pop(CODEC_METADATA_KEY, None)
+    if codec != 'none':
+        metadata[CODEC_METADATA_KEY] = codec
+        kwargs['ContentEncoding'] = codec
+    return s3.put_object(Bucket=bucket, Key=key, Body=compress(data, codec), Metadata=metadata, **kwargs)
+
+
+def codec_of(response):
+    """Codec of a get_object/head_object response, or 'none' for plain objects"""
+    codec = response.get('Metadata', {}).get(CODEC_METADATA_KEY) or response.get('ContentEncoding') or 'none'
+    codec = codec.strip().lower()
+    return 'none' if codec == 'identity' else codec
+
+
+def open_body(response):
+    """File-like object that yields the decompressed body as it streams in"""
+    codec = codec_of(response)
+    body = response['Body']
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=body, mode='rb')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("object is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(body)
+    if codec != 'none':
+        raise ValueError(f"unsupported storage codec {codec!r}")
+    return body
+
+
+def read_body(response):
+    """The whole decompressed body as bytes"""
+    return open_body(response).read()
@@ -3,6 +3,9 @@ import pandas as pd
 import psycopg2
 import matplotlib.pyplot as plt
 
+import dashboard_views
+import resilience
+
 # Load RDS credentials from secrets.toml
 rds_config = {
     "host": st.secrets["RDS_HOST"],
@@ -12,22 +15,49 @@ rds_config = {
     "port": st.secrets.get("RDS_PORT", 5432)  # optional
 }
 
-# Connect to RDS
+# The dashboard only reads, so it uses the read replica when one is configured
+read_config = dict(rds_config, host=st.secrets.get("RDS_REPLICA_HOST", rds_config["host"]))
+
+# Connect to RDS with timeouts. Retries and the circuit breaker come from the
+# resilience.call around each fetch below, which covers connect and query once.
 @st.cache_resource(ttl=600)
 def get_connection():
-    return psycopg2.connect(**rds_config)
+    return resilience.open_rds(**read_config)
 
-conn = get_connection()
+def _query(query, params=None):
+    try:
+        return pd.read_sql(query, get_connection(), params=params)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # Dropped connection (e.g. an RDS failover); reconnect on the next attempt
+        get_connection.clear()
+        raise
 
-# Load data
+# Load data from the materialized views (see dashboard_views.py); their size
+# doesn't grow with the number of results stored
 @st.cache_data(ttl=300)
-def fetch_data():
-    return pd.read_sql("SELECT * FROM lab_results", conn)
+def fetch_patients():
+    return resilience.call('rds', _query, dashboard_views.PATIENTS_SQL)['patient_id'].tolist()
 
-df = fetch_data()
+@st.cache_data(ttl=300)
+def fetch_latest(patient_id):
+    return resilience.call('rds', _query, dashboard_views.LATEST_SQL, (patient_id,))
+
+@st.cache_data(ttl=300)
+def fetch_status_counts():
+    return resilience.call('rds', _query, dashboard_views.STATUS_COUNTS_SQL)
+
+@st.cache_data(ttl=300)
+def fetch_explanations():
+    return resilience.call('rds', _query, dashboard_views.EXPLANATIONS_SQL)['explanation'].tolist()
 
 # Streamlit UI
 st.title("🩺 Lab Results Dashboard")
+patients = fetch_patients()
+if not patients:
+    st.info("No lab results yet.")
+    st.stop()
+patient_id = st.selectbox("Patient", patients)
+df = fetch_latest(patient_id)
 st.dataframe(df)
 
 # Bar chart
@@ -36,10 +66,13 @@ fig, ax = plt.subplots(figsize=(10, 5))
 df.plot(kind='bar', x='test_name', y='value', ax=ax)
 st.pyplot(fig)
 
+# Result status across all patients' latest results
+st.subheader("Status Counts")
+status_counts = fetch_status_counts()
+st.dataframe(status_counts.pivot(index='test_name', columns='status', values='results').fillna(0).astype(int))
+
 # Health summary
 st.subheader("Health Summary")
-explanations = df['explanation'].unique()
+explanations = fetch_explanations()
 for exp in explanations:
     st.write(exp)
-
-conn.close()
@@ -0,0 +1,58 @@
+"""
+Retrieval of EC2-generated summaries from S3.
+
+Summaries are cached in-process by key together with their ETag. Once a
+summary is cached, later reads send a conditional GET (IfNoneMatch). S3 answers
+304 with no body when the object is unchanged. A summary that is not cached
+yet is checked with a cheap HEAD first, so polling a pending job never
+downloads anything.
+"""
+from botocore.exceptions import ClientError
+
+import lrucache
+import s3errors
+import storage
+
+NOT_MODIFIED_CODES = {'304', 'NotModified'}
+
+# key -> (etag, text)
+default_cache = lrucache.LRUCache()
+
+
+def fetch_summary(s3, bucket, key, cache=default_cache):
+    """
+    Returns the summary text, or None if it has not been written yet.
+    Other S3 errors propagate.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        etag, text = cached
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key, IfNoneMatch=etag)
+        except ClientError as e:
+            code = s3errors.error_code(e)
+            if code in NOT_MODIFIED_CODES:
+                return text
+            if code in s3errors.MISSING_CODES:
+                cache.discard(key)
+                return None
+            raise
+    else:
+        try:
+            s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if s3errors.is_missing(e):
+                return None
+            raise
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            # Deleted between the HEAD and the GET
+            if s3errors.is_missing(e):
+                return None
+            raise
+
+    text = storage.read_body(obj).decode('utf-8')
+    cache.put(key, (obj.get('ETag'), text))
+    return text
+
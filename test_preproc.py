@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+import alerts
+import preproc
+
+
+@pytest.mark.parametrize('test, value, from_unit, expected', [
+   # Thousands per uL, however the lab spells it
+   ('Platelets', 250, '10^3/uL', 250),
+   ('Platelets', 250, 'x10^3/uL', 250),
+   ('Platelets', 250, 'K/uL', 250),
+   ('Platelets', 250, 'k/μL', 250),
+   ('Platelets', 250, 'thou/uL', 250),
+   ('Platelets', 250, 'x10E3/uL', 250),
+   ('Platelets', 250, '10*3/uL', 250),
+   ('Platelets', 250, '10^9/L', 250),
+   ('Platelets', 250, 'x10^9/L', 250),
+   # Plain counts per uL
+   ('Platelets', 250000, '/uL', 250),
+   ('Platelets', 250000, 'cells/uL', 250),
+   ('Platelets', 250000, 'cells/mm3', 250),
+   ('WBC', 6.8, 'K/uL', 6.8),
+   ('WBC', 6.8, '10^9/L', 6.8),
+   ('WBC', 6800, 'cells/uL', 6.8),
+   ('RBC', 4.7, '10^12/L', 4.7),
+   ('RBC', 4.7, 'M/uL', 4.7),
+   ('RBC', 4.7, 'x10E6/uL', 4.7),
+   ('Hematocrit', 0.42, 'L/L', 42),
+   ('Potassium', 4.1, 'mEq/L', 4.1),
+   ('TSH', 2.5, 'uIU/mL', 2.5),
+   ('Glucose', 5, 'mmol/L', 90),
+   ('Calcium', 2.4, 'mmol/L', 9.6),
+   ('Free T4', 12.87, 'pmol/L', 1),
+])
+def test_convert_value(test, value, from_unit, expected):
+   converted = preproc.convert_value(value, from_unit, preproc.target_units[test], test, strict=True)
+   assert converted == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('test, from_unit', [
+   ('Platelets', 'g/dL'),
+   ('WBC', '%'),
+   ('Glucose', 'mg/L'),
+   ('Hematocrit', 'g/dL'),
+])
+def test_convert_value_without_rule(test, from_unit):
+   target = preproc.target_units[test]
+   assert preproc.convert_value(1.0, from_unit, target, test, strict=True) is None
+   assert preproc.convert_value(1.0, from_unit, target, test) == 1.0
+
+
+def test_normal_platelets_in_k_per_ul_are_not_critical():
+   rows = preproc.preprocess_bloodwork_data(io.BytesIO(
+      b"panel_category,test_name,date,value,unit,reference_range\n"
+      b"CBC,Platelet Count,2024-01-01,250,K/uL,150-450\n"))
+   row = rows[0]
+   assert (row['value'], row['unit']) == (250, '10^3/uL')
+   assert alerts.check_row(row) is None